@@ -84,6 +84,7 @@ __copyright__ = "Copyright (c) 2004-2010 Leonard Richardson"
 __license__ = "New-style BSD"
 
 from sgmllib import SGMLParser, SGMLParseError
+import bisect
 import codecs
 import markupbase
 import types
@@ -114,6 +115,31 @@ class PageElement(object):
     """Contains the navigational information for some part of the page
     (either a tag or a piece of text)"""
 
+    # Tag and NavigableString keep their fields in slots. Among them
+    # are _treeIndex and _indexPosition, set on every element of an
+    # indexed soup by its TreeIndex and None elsewhere.
+    __slots__ = ()
+
+    def __getstate__(self):
+        """Pickle and copy only look in __dict__ on their own, so this
+        hands them the slots as well."""
+        state = dict(self.__dict__)
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if name in ('__dict__', '__weakref__'):
+                    continue
+                # through the descriptor, so an empty slot doesn't end
+                # up in Tag.__getattr__
+                try:
+                    state[name] = cls.__dict__[name].__get__(self, cls)
+                except AttributeError:
+                    pass
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def setup(self, parent=None, previous=None):
         """Sets up the initial relations between this element and
         other elements."""
@@ -152,6 +178,7 @@ class PageElement(object):
 
     def extract(self):
         """Destructively rips this element out of the tree."""
+        self._invalidateIndex()
         if self.parent:
             try:
                 del self.parent.contents[self.parent.index(self)]
@@ -187,6 +214,7 @@ class PageElement(object):
         return lastChild
 
     def insert(self, position, newChild):
+        self._invalidateIndex()
         if isinstance(newChild, basestring) \
             and not isinstance(newChild, NavigableString):
             newChild = NavigableString(newChild)
@@ -243,12 +271,19 @@ class PageElement(object):
 
         if newChildsLastElement.next:
             newChildsLastElement.next.previous = newChildsLastElement
+        if isinstance(self.contents, ReadOnlyList):
+            self.contents = []
         self.contents.insert(position, newChild)
 
     def append(self, tag):
         """Appends the given tag to the contents of this tag."""
         self.insert(len(self.contents), tag)
 
+    def _invalidateIndex(self):
+        "The tree this element is in is changing, so its index is stale."
+        if self._treeIndex is not None:
+            self._treeIndex.valid = False
+
     def findNext(self, name=None, attrs={}, text=None, **kwargs):
         """Returns the first item that matches the given criteria and
         appears after this Tag in the document."""
@@ -348,6 +383,19 @@ class PageElement(object):
                         element.name == name]
             else:
                 strainer = SoupStrainer(name, attrs, text, **kwargs)
+        # find*('tag-name') and friends: match on the name alone and
+        # stop at the limit, instead of asking a SoupStrainer about
+        # every element
+        elif text is None and not attrs and not kwargs \
+                 and (name is True or isinstance(name, basestring)):
+            results = ResultSet(SoupStrainer(name))
+            for element in generator():
+                if isinstance(element, Tag) and \
+                       (name is True or element.name == name):
+                    results.append(element)
+                    if len(results) >= limit:
+                        break
+            return results
         # Build a SoupStrainer
         else:
             strainer = SoupStrainer(name, attrs, text, **kwargs)
@@ -423,6 +471,10 @@ class PageElement(object):
 
 class NavigableString(unicode, PageElement):
 
+    __slots__ = ('parent', 'previous', 'next', 'previousSibling',
+                 'nextSibling', '_treeIndex', '_indexPosition',
+                 '__dict__', '__weakref__')
+
     def __new__(cls, value):
         """Create a new NavigableString.
 
@@ -432,8 +484,11 @@ class NavigableString(unicode, PageElement):
         how to handle non-ASCII characters.
         """
         if isinstance(value, unicode):
-            return unicode.__new__(cls, value)
-        return unicode.__new__(cls, value, DEFAULT_OUTPUT_ENCODING)
+            self = unicode.__new__(cls, value)
+        else:
+            self = unicode.__new__(cls, value, DEFAULT_OUTPUT_ENCODING)
+        self._treeIndex = self._indexPosition = None
+        return self
 
     def __getnewargs__(self):
         return (NavigableString.__str__(self),)
@@ -476,10 +531,51 @@ class Declaration(NavigableString):
     def __str__(self, encoding=DEFAULT_OUTPUT_ENCODING):
         return "<!%s>" % NavigableString.__str__(self, encoding)
 
+class ReadOnlyList(list):
+    """An empty list that a compact soup shares between all the tags
+    without attributes or contents. Changing it in place would change
+    every one of them, so it doesn't allow that. Copying or unpickling
+    a soup makes new ones, so check for one with isinstance()."""
+
+    def _readOnly(self, *args):
+        raise TypeError("this list is shared; assign a new one instead")
+
+    append = extend = insert = pop = remove = reverse = sort = _readOnly
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = _readOnly
+    __iadd__ = __imul__ = _readOnly
+
+class ReadOnlyDict(dict):
+    """The empty attribute map that goes with a shared empty attribute
+    list."""
+
+    def _readOnly(self, *args):
+        raise TypeError("this dict is shared; assign a new one instead")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = _readOnly
+    setdefault = update = _readOnly
+
 class Tag(PageElement):
 
     """Represents a found HTML tag with its attributes and contents."""
 
+    # A dictionary per tag costs several times what the fields in it
+    # do. Extra attributes still go in a __dict__, made when needed.
+    __slots__ = ('parent', 'previous', 'next', 'previousSibling',
+                 'nextSibling', 'parserClass', 'isSelfClosing', 'name',
+                 'attrs', 'attrMap', 'contents', 'hidden',
+                 'containsSubstitutions', 'convertHTMLEntities',
+                 'convertXMLEntities', 'escapeUnrecognizedEntities',
+                 '_treeIndex', '_indexPosition', '__dict__', '__weakref__')
+
+    # Shared by the tags of a compact soup that have no attributes or
+    # no contents.
+    EMPTY_ATTRS = ReadOnlyList()
+    EMPTY_ATTR_MAP = ReadOnlyDict()
+    EMPTY_CONTENTS = ReadOnlyList()
+
+    # True for a soup whose searches go through a TreeIndex.
+    indexed = False
+
     def _invert(h):
         "Cheap function to invert a hash."
         i = {}
@@ -532,8 +628,10 @@ class Tag(PageElement):
         if attrs is None:
             attrs = []
         self.attrs = attrs
+        self.attrMap = None
         self.contents = []
         self.setup(parent, previous)
+        self._treeIndex = self._indexPosition = None
         self.hidden = False
         self.containsSubstitutions = False
         self.convertHTMLEntities = parser.convertHTMLEntities
@@ -616,7 +714,11 @@ class Tag(PageElement):
     def __setitem__(self, key, value):
         """Setting tag[key] sets the value of the 'key' attribute for the
         tag."""
+        self._invalidateIndex()
         self._getAttrMap()
+        if isinstance(self.attrs, ReadOnlyList):
+            self.attrs = []
+            self.attrMap = {}
         self.attrMap[key] = value
         found = False
         for i in range(0, len(self.attrs)):
@@ -629,6 +731,7 @@ class Tag(PageElement):
 
     def __delitem__(self, key):
         "Deleting tag[key] deletes all 'key' attributes for the tag."
+        self._invalidateIndex()
         for item in self.attrs:
             if item[0] == key:
                 self.attrs.remove(item)
@@ -781,7 +884,7 @@ class Tag(PageElement):
         current = self.contents[0]
         while current is not None:
             next = current.next
-            if isinstance(current, Tag):
+            if isinstance(current, Tag) and current.contents:
                 del current.contents[:]
             current.parent = None
             current.previous = None
@@ -841,6 +944,14 @@ class Tag(PageElement):
         generator = self.recursiveChildGenerator
         if not recursive:
             generator = self.childGenerator
+        elif self._treeIndex is not None or self.indexed:
+            key = TreeIndex.key(name, attrs, text, kwargs)
+            index = key and self._getTreeIndex()
+            if index:
+                results = index.findAll(self, key, name, attrs, text,
+                                        limit, kwargs)
+                if results is not None:
+                    return results
         return self._findAll(name, attrs, text, limit, generator, **kwargs)
     findChildren = findAll
 
@@ -856,13 +967,36 @@ class Tag(PageElement):
 
     #Private methods
 
+    def _getTreeIndex(self):
+        """Returns an up to date TreeIndex covering this tag, or None if
+        the tag isn't part of an indexed soup."""
+        index = self._treeIndex
+        if index is not None and index.valid:
+            return index
+        if index is None and not self.indexed:
+            return None
+        # Either this is an indexed soup or this tag was in one when
+        # it was last indexed. Rebuild the index if it still is.
+        root = self
+        while root.parent is not None:
+            root = root.parent
+        if not root.indexed:
+            return None
+        TreeIndex(root)
+        if self._treeIndex.valid:
+            return self._treeIndex
+        return None
+
     def _getAttrMap(self):
         """Initializes a map representation of this tag's attributes,
         if not already initialized."""
-        if not getattr(self, 'attrMap'):
-            self.attrMap = {}
-            for (key, value) in self.attrs:
-                self.attrMap[key] = value
+        if self.attrMap is None:
+            if isinstance(self.attrs, ReadOnlyList):
+                self.attrMap = self.EMPTY_ATTR_MAP
+            else:
+                self.attrMap = {}
+                for (key, value) in self.attrs:
+                    self.attrMap[key] = value
         return self.attrMap
 
     #Generator methods
@@ -1001,6 +1135,63 @@ class SoupStrainer:
                 result = matchAgainst == markup
         return result
 
+class CompiledStrainer(SoupStrainer):
+    """A SoupStrainer for tags that works out how to match each part
+    of the query once, when it's created, instead of for every element
+    it's tried against. Create one for a query you run over and over
+    and pass it to find() or findAll() in place of a tag name:
+
+     CELL = CompiledStrainer('td', {'class': 'cal_td'})
+     cells = soup.findAll(CELL)
+
+    Queries for text, and parseOnlyThese, are matched the usual way."""
+
+    def __init__(self, name=None, attrs={}, text=None, **kwargs):
+        SoupStrainer.__init__(self, name, attrs, text, **kwargs)
+        if self.text is None:
+            self.tests = []
+            if self.name and self.name is not True:
+                self.tests.append(self._compileName(self.name))
+            for attr, matchAgainst in (self.attrs or {}).items():
+                self.tests.append(self._compileAttr(attr, matchAgainst))
+            self.search = self._searchCompiled
+
+    def _compileName(self, matchAgainst):
+        if callable(matchAgainst):
+            return matchAgainst
+        if isinstance(matchAgainst, basestring):
+            return lambda tag: tag.name == matchAgainst
+        if hasattr(matchAgainst, 'match'):
+            return lambda tag: tag.name and matchAgainst.search(tag.name)
+        if hasattr(matchAgainst, '__iter__'):
+            return lambda tag: tag.name in matchAgainst
+        return lambda tag: self._matches(tag, matchAgainst)
+
+    def _compileAttr(self, attr, matchAgainst):
+        if matchAgainst is True:
+            return lambda tag: tag._getAttrMap().get(attr) is not None
+        if matchAgainst is None:
+            return lambda tag: tag._getAttrMap().get(attr) is None
+        if callable(matchAgainst):
+            return lambda tag: matchAgainst(tag._getAttrMap().get(attr))
+        if isinstance(matchAgainst, basestring):
+            return lambda tag: tag._getAttrMap().get(attr) == matchAgainst
+        if hasattr(matchAgainst, 'match'):
+            def test(tag):
+                value = tag._getAttrMap().get(attr)
+                return value and matchAgainst.search(value)
+            return test
+        return lambda tag: self._matches(tag._getAttrMap().get(attr),
+                                         matchAgainst)
+
+    def _searchCompiled(self, markup):
+        if not isinstance(markup, Tag):
+            return None
+        for test in self.tests:
+            if not test(markup):
+                return None
+        return markup
+
 class ResultSet(list):
     """A ResultSet is just a list that keeps track of the SoupStrainer
     that created it."""
@@ -1008,6 +1199,106 @@ class ResultSet(list):
         list.__init__([])
         self.source = source
 
+class TreeIndex:
+    """Maps tag names, and the exact values of id and class attributes,
+    to the tags that have them, so that findAll() can look tags up
+    instead of walking the tree.
+
+    Every element in the tree is stamped with the index and its
+    position in document order, which makes the descendants of a tag
+    the elements between its own position and that of its last
+    descendant. Any change to the tree invalidates the index, and a
+    new one is built the next time the tree is searched."""
+
+    ATTRS = ('id', 'class')
+    EMPTY = ([], [])
+
+    # Below this many elements, walking a tag's descendants is quicker
+    # than looking them up.
+    MIN_SIZE = 64
+
+    def __init__(self, root):
+        self.valid = True
+        self.names = {}
+        self.values = {}
+        root._treeIndex = self
+        root._indexPosition = 0
+        position = 0
+        for element in root.recursiveChildGenerator():
+            position += 1
+            element._treeIndex = self
+            element._indexPosition = position
+            if isinstance(element, Tag):
+                self._add(self.names, element.name, position, element)
+                values = {}
+                for key, value in element.attrs:
+                    if key in self.ATTRS:
+                        # the last one wins, as in Tag.attrMap
+                        values[key] = value
+                for item in values.items():
+                    self._add(self.values, item, position, element)
+
+    def _add(self, table, key, position, element):
+        entry = table.get(key)
+        if entry is None:
+            entry = table[key] = ([], [])
+        entry[0].append(position)
+        entry[1].append(element)
+
+    def key(name, attrs, text, kwargs):
+        """Returns what to look up to answer a findAll() query: an
+        (attribute, value) pair or a tag name. None if the query can't
+        be answered from an index."""
+        if isinstance(name, CompiledStrainer) and not attrs and not kwargs:
+            return TreeIndex.key(name.name, name.attrs, name.text, {})
+        if text is not None or isinstance(name, SoupStrainer) \
+               or isinstance(attrs, basestring):
+            return None
+        for key in TreeIndex.ATTRS:
+            if key in kwargs:
+                value = kwargs[key]
+            else:
+                value = attrs and attrs.get(key)
+            if isinstance(value, basestring):
+                return (key, value)
+        if isinstance(name, basestring):
+            return name
+        return None
+    key = staticmethod(key)
+
+    def findAll(self, tag, key, name, attrs, text, limit, kwargs):
+        """Returns the same thing as tag.findAll(name, attrs, True,
+        text, limit, **kwargs), given its key(), or None if walking the
+        tree would be quicker."""
+        start = tag._indexPosition
+        if tag.nextSibling is not None:
+            end = tag.nextSibling._indexPosition - 1
+        else:
+            end = tag._lastRecursiveChild()._indexPosition
+        if end - start < self.MIN_SIZE:
+            return None
+        if isinstance(key, tuple):
+            positions, elements = self.values.get(key, self.EMPTY)
+        else:
+            positions, elements = self.names.get(key, self.EMPTY)
+        first = bisect.bisect_right(positions, start)
+        last = bisect.bisect_right(positions, end)
+        if isinstance(name, SoupStrainer):
+            strainer = name
+        else:
+            strainer = SoupStrainer(name, attrs, text, **kwargs)
+        results = ResultSet(strainer)
+        if strainer is not name and not attrs and not kwargs:
+            # Looked up by name, so everything found matches.
+            results.extend(elements[first:last][:limit or None])
+            return results
+        for element in elements[first:last]:
+            if strainer.search(element):
+                results.append(element)
+                if limit and len(results) >= limit:
+                    break
+        return results
+
 # Now, some helper functions.
 
 def buildTagMap(default, *args):
@@ -1061,6 +1352,16 @@ class BeautifulStoneSoup(Tag, SGMLParser):
                        lambda x: '<!' + x.group(1) + '>')
                       ]
 
+    # The same fixes as MARKUP_MASSAGE, in a single scan of the
+    # document. Each of them only changes text inside one <...>, and
+    # the first only adds a space there, so applying both in turn to
+    # every <...> either one would change gives exactly the same
+    # result as two passes over the whole document.
+    COMBINED_MARKUP_MASSAGE = [(re.compile('<!\s+[^<>]*>|<[^<>]*/>'),
+                                lambda x, fixes=MARKUP_MASSAGE:
+                                reduce(lambda tag, (fix, m): fix.sub(m, tag),
+                                       fixes, x.group(0)))]
+
     ROOT_TAG_NAME = u'[document]'
 
     HTML_ENTITIES = "html"
@@ -1077,7 +1378,8 @@ class BeautifulStoneSoup(Tag, SGMLParser):
 
     def __init__(self, markup="", parseOnlyThese=None, fromEncoding=None,
                  markupMassage=True, smartQuotesTo=XML_ENTITIES,
-                 convertEntities=None, selfClosingTags=None, isHTML=False):
+                 convertEntities=None, selfClosingTags=None, isHTML=False,
+                 sniffEncoding=True, indexed=False, compact=False):
         """The Soup object is initialized as the 'root tag', and the
         provided markup (which can be a string or a file-like object)
         is fed into the underlying parser.
@@ -1101,10 +1403,36 @@ class BeautifulStoneSoup(Tag, SGMLParser):
 
         You can pass in a custom list of (RE object, replace method)
         tuples to get Beautiful Soup to scrub your input the way you
-        want."""
-
+        want. COMBINED_MARKUP_MASSAGE does the default scrubbing in
+        one pass instead of two.
+
+        If you already know the encoding of the document (say, from
+        an HTTP Content-Type header), pass it in as fromEncoding and
+        False for sniffEncoding. Beautiful Soup will then decode the
+        document with it straight away instead of looking for
+        declarations in the document. As in a browser, Latin-1 and
+        ASCII are read as windows-1252.
+
+        If you're going to search the same soup many times, pass in
+        True for indexed. The first search then builds a TreeIndex of
+        the tree, and searches by tag name, id or class become
+        dictionary lookups.
+
+        If you're going to keep the soup around, pass in True for
+        compact. Tags then share their name and attribute strings
+        with other tags that have the same ones, and tags without
+        attributes or contents share one read-only empty list for
+        them. A compact tree takes less memory, but you have to change
+        it through methods like append() and tag[key] = value, not by
+        changing tag.contents or tag.attrs in place."""
+
+        self.indexed = indexed
+        # reset() looks at this before Tag.__init__ sets it
+        self._treeIndex = None
+        self.compact = compact
         self.parseOnlyThese = parseOnlyThese
         self.fromEncoding = fromEncoding
+        self.sniffEncoding = sniffEncoding
         self.smartQuotesTo = smartQuotesTo
         self.convertEntities = convertEntities
         # Set the rules for how we'll deal with the entities we
@@ -1143,6 +1471,7 @@ class BeautifulStoneSoup(Tag, SGMLParser):
         except StopParsing:
             pass
         self.markup = None                 # The markup can now be GCed
+        self.compactStrings = None
 
     def convert_charref(self, name):
         """This method fixes a bug in Python's SGMLParser."""
@@ -1163,7 +1492,8 @@ class BeautifulStoneSoup(Tag, SGMLParser):
         else:
             dammit = UnicodeDammit\
                      (markup, [self.fromEncoding, inDocumentEncoding],
-                      smartQuotesTo=self.smartQuotesTo, isHTML=isHTML)
+                      smartQuotesTo=self.smartQuotesTo, isHTML=isHTML,
+                      sniff=self.sniffEncoding)
             markup = dammit.unicode
             self.originalEncoding = dammit.originalEncoding
             self.declaredHTMLEncoding = dammit.declaredHTMLEncoding
@@ -1207,17 +1537,24 @@ class BeautifulStoneSoup(Tag, SGMLParser):
                or self.instanceSelfClosingTags.has_key(name)
 
     def reset(self):
+        self._invalidateIndex()
         Tag.__init__(self, self, self.ROOT_TAG_NAME)
         self.hidden = 1
         SGMLParser.reset(self)
         self.currentData = []
         self.currentTag = None
+        self.compactStrings = {}
         self.tagStack = []
         self.quoteStack = []
         self.pushTag(self)
 
     def popTag(self):
         tag = self.tagStack.pop()
+        if self.compact:
+            if tag.contents:
+                tag.contents = list(tag.contents) # no room to grow
+            else:
+                tag.contents = Tag.EMPTY_CONTENTS
 
         #print "Pop", tag.name
         if self.tagStack:
@@ -1340,6 +1677,8 @@ class BeautifulStoneSoup(Tag, SGMLParser):
             return
 
         tag = Tag(self, name, attrs, self.currentTag, self.previous)
+        if self.compact:
+            self._compactTag(tag)
         if self.previous:
             self.previous.next = tag
         self.previous = tag
@@ -1352,6 +1691,19 @@ class BeautifulStoneSoup(Tag, SGMLParser):
             self.literal = 1
         return tag
 
+    def _compactTag(self, tag):
+        """Shares the tag's name and attributes with the tags parsed
+        before it that have the same ones."""
+        share = self.compactStrings.setdefault
+        tag.name = share(tag.name, tag.name)
+        if not tag.attrs:
+            tag.attrs = Tag.EMPTY_ATTRS
+            return
+        def sharePair((key, value)):
+            pair = (share(key, key), share(value, value))
+            return share(pair, pair)
+        tag.attrs = map(sharePair, tag.attrs)
+
     def unknown_endtag(self, name):
         #print "End tag %s" % name
         if self.quoteStack and self.quoteStack[-1] != name:
@@ -1698,6 +2050,130 @@ class BeautifulSOAP(BeautifulStoneSoup):
                 parent[tag.name] = tag.contents[0]
         BeautifulStoneSoup.popTag(self)
 
+class SoupStream(BeautifulSoup):
+
+    """Parses HTML a piece at a time, the way BeautifulSoup does, but
+    doesn't keep the tree. Instead a handler hears about each tag:
+
+     handler.start(tag) is called when a tag starts. Its name,
+     attributes and parents (which are all still open) are known, but
+     none of its contents. Return True to keep what's inside it.
+
+     handler.end(tag) is called when the tag ends. A tag that was
+     kept, or is inside one that was, has all its contents by then.
+     Raise StopParsing once there's nothing more to find, and the
+     rest of the document is ignored.
+
+    Everything outside the kept tags is thrown away as soon as it's
+    parsed, so the memory used is bounded by the biggest kept tag
+    rather than by the document:
+
+     stream = SoupStream(handler)
+     for chunk in chunks:
+         stream.feed(chunk)
+     stream.close()
+
+    Feed it Unicode, or strings in fromEncoding."""
+
+    def __init__(self, handler, markupMassage=True, fromEncoding=None,
+                 **kwargs):
+        self.handler = handler
+        self.keepDepth = 0
+        self.stopped = False
+        self.pending = u''
+        self.decoder = None
+        self.smartQuotes = None
+        if fromEncoding:
+            fromEncoding = UnicodeDammit.trustedEncoding(fromEncoding)
+            self.decoder = codecs.getincrementaldecoder(fromEncoding)('replace')
+        BeautifulSoup.__init__(self, u'', fromEncoding=fromEncoding,
+                               **kwargs)
+        self.originalEncoding = fromEncoding
+        if self.decoder and self.smartQuotesTo and \
+               fromEncoding.lower() in UnicodeDammit.SMART_QUOTE_ENCODINGS:
+            # Every byte is a character in these, so the smart quotes
+            # can be replaced a chunk at a time, before decoding.
+            self.smartQuotes = UnicodeDammit('', smartQuotesTo=self.smartQuotesTo)
+        if markupMassage and not hasattr(markupMassage, '__iter__'):
+            markupMassage = self.MARKUP_MASSAGE
+        self.markupMassage = markupMassage or []
+
+    def feed(self, markup):
+        "Parses another piece of the document."
+        if self.stopped:
+            return
+        if self.decoder and isinstance(markup, str):
+            if self.smartQuotes:
+                markup = self.smartQuotes.subMSChars(markup)
+            markup = self.decoder.decode(markup)
+        markup = self.pending + markup
+        # The massage only ever matches inside a tag, so hold back the
+        # last tag in case it isn't all here yet.
+        end = markup.rfind('<')
+        if end == -1:
+            end = len(markup)
+        self.pending = markup[end:]
+        self._feedPiece(markup[:end])
+
+    def close(self):
+        """Parses the rest of the document and ends the tags still
+        open, as BeautifulSoup does at the end of a document."""
+        if self.decoder:
+            self.pending += self.decoder.decode('', True)
+        self._feedPiece(self.pending)
+        self.pending = u''
+        try:
+            if not self.stopped:
+                self.endData()
+                while self.currentTag.name != self.ROOT_TAG_NAME:
+                    self.popTag()
+        except StopParsing:
+            pass
+        self.stopped = True
+
+    def _feedPiece(self, markup):
+        if self.stopped:
+            return
+        for fix, m in self.markupMassage:
+            markup = fix.sub(m, markup)
+        try:
+            SGMLParser.feed(self, markup)
+        except StopParsing:
+            self.stopped = True
+
+    def pushTag(self, tag):
+        if tag is self:
+            BeautifulSoup.pushTag(self, tag)
+        elif self.keepDepth:
+            BeautifulSoup.pushTag(self, tag)
+            self.handler.start(tag)
+        else:
+            # Only its parents know about a tag that isn't kept, and
+            # they don't hold on to it.
+            tag.previous = None
+            self.tagStack.append(tag)
+            self.currentTag = tag
+            if self.handler.start(tag):
+                self.keepDepth = len(self.tagStack)
+            else:
+                self.previous = None
+
+    def popTag(self):
+        tag = self.tagStack[-1]
+        BeautifulSoup.popTag(self)
+        self.handler.end(tag)
+        if len(self.tagStack) < self.keepDepth:
+            # The kept tag is done; what comes next isn't part of it.
+            self.keepDepth = 0
+            self.previous = None
+        return self.currentTag
+
+    def endData(self, containerClass=NavigableString):
+        if self.keepDepth:
+            BeautifulSoup.endData(self, containerClass)
+        elif self.currentData:
+            self.currentData = []
+
 #Enterprise class names! It has come to our attention that some people
 #think the names of the Beautiful Soup parser classes are too silly
 #and "unprofessional" for use in enterprise screen-scraping. We feel
@@ -1761,13 +2237,46 @@ class UnicodeDammit:
     CHARSET_ALIASES = { "macintosh" : "mac-roman",
                         "x-sjis" : "shift-jis" }
 
+    # Encodings that can have MS smart quotes in them, which
+    # _convertFrom replaces before decoding.
+    SMART_QUOTE_ENCODINGS = ("windows-1252", "iso-8859-1", "iso-8859-2")
+
+    # Python codec names of the labels a trusted encoding is read as
+    # windows-1252 for, the way browsers read them: servers that say
+    # Latin-1 or ASCII mostly mean windows-1252, smart quotes and all.
+    WINDOWS_1252_CODECS = ("iso8859-1", "ascii")
+
+    def trustedEncoding(encoding):
+        """Returns the encoding to decode with when encoding comes
+        from a source that's trusted, like a Content-Type header."""
+        try:
+            if codecs.lookup(encoding).name in UnicodeDammit.WINDOWS_1252_CODECS:
+                return "windows-1252"
+        except (LookupError, TypeError, ValueError):
+            pass
+        return encoding
+    trustedEncoding = staticmethod(trustedEncoding)
+
     def __init__(self, markup, overrideEncodings=[],
-                 smartQuotesTo='xml', isHTML=False):
+                 smartQuotesTo='xml', isHTML=False, sniff=True):
+        """If sniff is False, the overrideEncodings are trusted: the
+        first one that decodes the markup is used, without looking for
+        XML or META declarations. Latin-1 and ASCII are read as
+        windows-1252 (see trustedEncoding). Detection only happens if
+        none of them work."""
         self.declaredHTMLEncoding = None
-        self.markup, documentEncoding, sniffedEncoding = \
-                     self._detectEncoding(markup, isHTML)
         self.smartQuotesTo = smartQuotesTo
         self.triedEncodings = []
+        if not sniff and markup and not isinstance(markup, unicode):
+            self.markup = markup
+            for proposedEncoding in overrideEncodings:
+                u = self._convertFrom(self.trustedEncoding(proposedEncoding))
+                if u:
+                    self.unicode = u
+                    return
+            self.triedEncodings = []
+        self.markup, documentEncoding, sniffedEncoding = \
+                     self._detectEncoding(markup, isHTML)
         if markup == '' or isinstance(markup, unicode):
             self.originalEncoding = None
             self.unicode = unicode(markup)
@@ -1795,6 +2304,12 @@ class UnicodeDammit:
         self.unicode = u
         if not u: self.originalEncoding = None
 
+    def subMSChars(self, markup):
+        """Changes every MS smart quote in a string to an XML or HTML
+        entity."""
+        return re.compile("([\x80-\x9f])").sub \
+               (lambda(x): self._subMSChar(x.group(1)), markup)
+
     def _subMSChar(self, orig):
         """Changes a MS smart quote character to an XML or HTML
         entity."""
@@ -1815,12 +2330,9 @@ class UnicodeDammit:
 
         # Convert smart quotes to HTML if coming from an encoding
         # that might have them.
-        if self.smartQuotesTo and proposed.lower() in("windows-1252",
-                                                      "iso-8859-1",
-                                                      "iso-8859-2"):
-            markup = re.compile("([\x80-\x9f])").sub \
-                     (lambda(x): self._subMSChar(x.group(1)),
-                      markup)
+        if self.smartQuotesTo and \
+               proposed.lower() in self.SMART_QUOTE_ENCODINGS:
+            markup = self.subMSChars(markup)
 
         try:
             # print "Trying to convert document to %s" % proposed
@@ -0,0 +1,278 @@
+#!/usr/bin/python
+"""
+Offline benchmarks for schoolloop.py, run against the fixtures in bench/data
+so they don't need a network, an account or Schoolloop's good mood.
+
+Each benchmark runs in a forked child for at least --time seconds and reports
+throughput, the median and 99th percentile time of one run, and how far it
+pushed the peak RSS above what the process started with.
+
+	python bench/bench.py                   # everything
+	python bench/bench.py parse calendar    # benchmarks matching any pattern
+	python bench/bench.py --save before.json
+	python bench/bench.py --compare before.json
+"""
+
+import os, sys, re, time, resource, cPickle, json, mimetools, urllib, urllib2
+from cStringIO import StringIO
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import schoolloop
+from BeautifulSoup import BeautifulSoup
+from fixtures import FIXTURES, fixture
+
+SIZES = ['small', 'typical', 'pathological']
+
+class FixtureHandler (urllib2.BaseHandler):
+	"""
+	Answers every request from the fixtures, logging in anyone with any
+	password, the way Schoolloop answers the real requests.
+	"""
+	handler_order = 100 # ahead of the real HTTP handlers
+
+	def __init__ (self, size='typical'):
+		self.size = size
+		self.requests = 0
+
+	def respond (self, req, code, body='', headers=()):
+		headers = ''.join('%s: %s\r\n' % header for header in headers)
+		response = urllib.addinfourl(StringIO(body), mimetools.Message(StringIO(headers)),
+			req.get_full_url(), code)
+		response.msg = code == 200 and 'OK' or 'Found'
+		return response
+
+	def fixture_open (self, req):
+		self.requests += 1
+		path = req.get_selector().split('?')[0]
+		if path == '/portal/login':
+			return self.respond(req, 302, headers=[('Location', req.get_full_url().replace(req.get_selector(), '/portal/student_home')),
+				('Set-Cookie', 'JSESSIONID=%d; Path=/' % self.requests)])
+		if path == '/calendar/setCalendarSettings':
+			return self.respond(req, 302, headers=[('Location', '/calendar/month')])
+		for page, page_path in schoolloop.PAGE_TABLE.items():
+			if path == page_path:
+				body = fixture('%s-%s.html' % ({'main' : 'student_home', 'dropbox' : 'drop_box',
+					'calendar' : 'calendar_month'}[page], self.size))
+				return self.respond(req, 200, body, [('Content-Type', 'text/html;charset=UTF-8'),
+					('Content-Length', str(len(body)))])
+		raise urllib2.URLError('no fixture for %s' % path)
+
+	http_open = https_open = fixture_open
+
+class FixtureSchoolLoop (schoolloop.SchoolLoop):
+	"""
+	SchoolLoop that talks to a FixtureHandler instead of the network.
+	"""
+	size = 'typical'
+
+	def __init__ (self, *args, **kwargs):
+		super(FixtureSchoolLoop, self).__init__(*args, **kwargs)
+		self.opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(self.cookiejar),
+			self.lrHandler, FixtureHandler(self.size))
+
+def logged_in (size):
+	FixtureSchoolLoop.size = size
+	s = FixtureSchoolLoop('example')
+	s.login('student', 'password')
+	return s
+
+# the extractor each fixture page goes with
+EXTRACTORS = {
+	'main' : [('classes', schoolloop.parse_classes), ('assignments', schoolloop.parse_assignments)],
+	'dropbox' : [('dropbox_files', schoolloop.parse_dropbox_files)],
+	'calendar' : [('calendar', schoolloop.parse_calendar), ('timezone', schoolloop.parse_timezone)]
+}
+
+# the streaming version of each extractor
+STREAMS = {
+	'classes' : schoolloop.stream_classes,
+	'assignments' : schoolloop.stream_assignments,
+	'dropbox_files' : schoolloop.stream_dropbox_files,
+	'calendar' : schoolloop.stream_events
+}
+
+# the region of the page each client method parses
+REGIONS = {'classes' : 'classes', 'dropbox_files' : 'dropbox'}
+
+def benchmarks ():
+	"""
+	Returns (name, setup, bytes) for every benchmark. setup() prepares
+	whatever the benchmark needs and returns the function to time; bytes is
+	how much HTML one run parses, or None.
+	"""
+	benches = []
+	for name in sorted(FIXTURES):
+		page = FIXTURES[name][0]
+		label = name[:-len('.html')]
+		size = len(fixture(name))
+
+		# building the whole tree
+		benches.append(('parse/%s' % label, lambda name=name: (lambda html=fixture(name): BeautifulSoup(html)), size))
+		# the same as a compact soup
+		benches.append(('parse_compact/%s' % label, lambda name=name: (lambda html=fixture(name):
+			BeautifulSoup(html, compact=True)), size))
+
+		for extractor, func in EXTRACTORS[page]:
+			# walking a prebuilt tree
+			benches.append(('extract/%s/%s' % (extractor, label),
+				lambda name=name, func=func: (lambda soup=BeautifulSoup(fixture(name)): func(soup)), None))
+			# the same with a TreeIndex, built by the warm up run
+			benches.append(('extract_indexed/%s/%s' % (extractor, label),
+				lambda name=name, func=func: (lambda soup=BeautifulSoup(fixture(name), indexed=True): func(soup)), None))
+			if extractor in REGIONS:
+				# parsing only the region the client uses, then walking it
+				strainer = schoolloop.REGIONS[REGIONS[extractor]]
+				benches.append(('region/%s/%s' % (extractor, label),
+					lambda name=name, func=func, strainer=strainer: (lambda html=fixture(name):
+					func(BeautifulSoup(html, parseOnlyThese=strainer))), size))
+			if extractor in STREAMS:
+				# the same rows, straight from the markup with no tree
+				benches.append(('stream/%s/%s' % (extractor, label),
+					lambda name=name, stream=STREAMS[extractor]: (lambda html=fixture(name):
+					list(stream(html, 'utf-8'))), size))
+
+	for size in SIZES:
+		# the client methods with a fresh page cache each time: fetch, decode,
+		# parse and extract
+		for method in ('class_list', 'assignment_list', 'dropbox_files', 'calendar',
+				'iter_classes', 'iter_assignments', 'iter_dropbox_files', 'iter_events'):
+			def setup (size=size, method=method):
+				s = logged_in(size)
+				def run ():
+					s.pages.clear()
+					return list(getattr(s, method)())
+				return run
+			benches.append(('client/%s/%s' % (method, size), setup, None))
+
+		# what main() does: log in, then print everything
+		def setup (size=size):
+			def run ():
+				FixtureSchoolLoop.size = size
+				real, schoolloop.SchoolLoop = schoolloop.SchoolLoop, FixtureSchoolLoop
+				stdout, sys.stdout = sys.stdout, StringIO()
+				try:
+					schoolloop.main(['-u', 'student', '-p', 'password', '-c', '-d', '-e', '-a'])
+				finally:
+					schoolloop.SchoolLoop, sys.stdout = real, stdout
+			return run
+		benches.append(('e2e/main/%s' % size, setup, None))
+	return benches
+
+def percentile (times, p):
+	return times[min(len(times) - 1, int(len(times) * p / 100.0))]
+
+def measure (setup, min_time=1.0, min_runs=5):
+	"""
+	Times the function setup() returns until both min_time and min_runs are
+	reached. Returns a dict of results.
+	"""
+	start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	func = setup()
+	func() # warm up
+	times = []
+	total = 0.0
+	while total < min_time or len(times) < min_runs:
+		start = time.time()
+		func()
+		elapsed = time.time() - start
+		times.append(elapsed)
+		total += elapsed
+	times.sort()
+	return {
+		'runs' : len(times),
+		'per_sec' : len(times) / total,
+		'p50' : percentile(times, 50),
+		'p99' : percentile(times, 99),
+		'peak_kb' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_rss
+	}
+
+def measure_forked (setup, min_time=1.0):
+	"""
+	Runs measure() in a child process so the peak RSS belongs to one
+	benchmark and nothing it allocates lingers for the next one.
+	"""
+	read, write = os.pipe()
+	pid = os.fork()
+	if pid == 0:
+		os.close(read)
+		try:
+			result = measure(setup, min_time)
+		except Exception, e:
+			result = {'error' : '%s: %s' % (e.__class__.__name__, e)}
+		os.write(write, cPickle.dumps(result, 2))
+		os._exit(0)
+	os.close(write)
+	data = []
+	while True:
+		chunk = os.read(read, 65536)
+		if not chunk:
+			break
+		data.append(chunk)
+	os.close(read)
+	os.waitpid(pid, 0)
+	return cPickle.loads(''.join(data))
+
+def main (args):
+	from optparse import OptionParser
+
+	parser = OptionParser(usage="usage: %prog [options] [pattern ...]")
+	parser.add_option("-t", "--time",
+		action="store",
+		type="float",
+		dest="time",
+		default=1.0,
+		help="Seconds to run each benchmark for.")
+	parser.add_option("--no-fork",
+		action="store_false",
+		dest="fork",
+		default=True,
+		help="Run every benchmark in this process; peak memory is then cumulative.")
+	parser.add_option("-s", "--save",
+		action="store",
+		dest="save",
+		default=None,
+		help="Write the results to a JSON file.")
+	parser.add_option("-c", "--compare",
+		action="store",
+		dest="compare",
+		default=None,
+		help="Compare the median times to a JSON file written by --save.")
+	(options, patterns) = parser.parse_args(args)
+
+	baseline = {}
+	if options.compare:
+		with open(options.compare) as f:
+			baseline = json.load(f)
+
+	results = {}
+	print '%-52s %7s %9s %9s %9s %9s %9s' % ('benchmark', 'runs', 'runs/s', 'MB/s', 'p50 ms', 'p99 ms', 'peak KB'),
+	print baseline and '  vs p50' or ''
+	for name, setup, size in benchmarks():
+		if patterns and not any(re.search(pattern, name) for pattern in patterns):
+			continue
+		if options.fork:
+			result = measure_forked(setup, options.time)
+		else:
+			result = measure(setup, options.time)
+		results[name] = result
+		if 'error' in result:
+			print '%-52s %s' % (name, result['error'])
+			continue
+		print '%-52s %7d %9.1f %9s %9.3f %9.3f %9d' % (name, result['runs'], result['per_sec'],
+			size and '%.2f' % (size * result['per_sec'] / 1e6) or '-',
+			result['p50'] * 1000, result['p99'] * 1000, result['peak_kb']),
+		if name in baseline and 'p50' in baseline[name]:
+			print '  %+6.1f%%' % ((result['p50'] / baseline[name]['p50'] - 1) * 100)
+		else:
+			print
+		sys.stdout.flush()
+
+	if options.save:
+		with open(options.save, 'w') as f:
+			json.dump(results, f, indent=1, sort_keys=True)
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
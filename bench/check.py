@@ -0,0 +1,180 @@
+#!/usr/bin/python
+"""
+Checks how SchoolLoop and AsyncSchoolLoop cope with a misbehaving server,
+against a bench/fakeserver.py started for each check. Prints each check's
+result and exits with 1 if any failed.
+
+	python bench/check.py                   # every check
+	python bench/check.py settings          # checks matching any pattern
+"""
+
+import os, sys, re, shutil, tempfile, traceback
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakeserver, schoolloop
+from BeautifulSoup import BeautifulSoup, SoupStream
+from schoolloop import SchoolLoop, LoginError, ConnectionPool, ResponseCache
+from schoolloop_async import AsyncSchoolLoop, EventLoop, Return
+
+CHECKS = []
+
+def check(func):
+	CHECKS.append(func)
+	return func
+
+def host(server):
+	return '%s:%d' % server.server_address
+
+def raises(exc_class, func, *args):
+	try:
+		func(*args)
+	except exc_class:
+		return True
+	return False
+
+@check
+def settings_logout(server):
+	"""
+	The calendar settings POST always gets the login redirect: calendar()
+	logs in again once, then gives up with LoginError.
+	"""
+	s = SchoolLoop('example', https=False, host=host(server))
+	assert s.login('student', 'password')
+	server.logout_settings = True
+	logins = server.stats['logins']
+	assert raises(LoginError, s.calendar, 10, 2012), 'no LoginError'
+	assert server.stats['logins'] - logins == 1, '%d logins' % (server.stats['logins'] - logins)
+
+@check
+def settings_logout_relogin(server):
+	"""
+	The same, once the filter was set for an earlier session: relogin()
+	sets it again and gives up with LoginError.
+	"""
+	s = SchoolLoop('example', https=False, host=host(server))
+	assert s.login('student', 'password')
+	s.calendar(10, 2012)
+	server.expire_all()
+	server.logout_settings = True
+	logins = server.stats['logins']
+	assert raises(LoginError, s.calendar, 11, 2012), 'no LoginError'
+	assert server.stats['logins'] - logins == 1, '%d logins' % (server.stats['logins'] - logins)
+
+@check
+def settings_logout_async(server):
+	"""
+	settings_logout and settings_logout_relogin for AsyncSchoolLoop.
+	"""
+	loop = EventLoop()
+	s = AsyncSchoolLoop('example', loop, https=False, host=host(server))
+	def run(first):
+		assert (yield s.login('student', 'password'))
+		if first:
+			yield s.calendar(10, 2012)
+			server.expire_all()
+		server.logout_settings = True
+		logins = server.stats['logins']
+		try:
+			yield s.calendar(11, 2012)
+		except LoginError:
+			raise Return(server.stats['logins'] - logins)
+		raise AssertionError('no LoginError')
+	for first in (False, True):
+		server.logout_settings = False
+		logins = loop.run(run(first))
+		assert logins == 1, '%d logins' % logins
+
+@check
+def revalidate_keepalive(server):
+	"""
+	Pages revalidated with a 304 leave their connection in the pool.
+	"""
+	directory = tempfile.mkdtemp()
+	pool = ConnectionPool()
+	try:
+		s = SchoolLoop('example', https=False, host=host(server), pool=pool,
+			response_cache=ResponseCache(directory))
+		assert s.login('student', 'password')
+		for i in range(6):
+			s.page('main', cache=False)
+		assert server.stats['not_modified'] == 5, '%d not modified' % server.stats['not_modified']
+		assert pool.stats['created'] == 1, '%d connections' % pool.stats['created']
+	finally:
+		# or the server's handler thread is still waiting on it at exit
+		pool.close()
+		shutil.rmtree(directory)
+
+@check
+def cookiejar_no_shared_cache(server):
+	"""
+	Clients given only a cookiejar don't know whose session it is, so they
+	leave a shared ResponseCache alone instead of revalidating each other's
+	pages.
+	"""
+	directory = tempfile.mkdtemp()
+	try:
+		cache = ResponseCache(directory)
+		for user in ('student', 'other'):
+			s = SchoolLoop('example', https=False, host=host(server))
+			assert s.login(user, 'password')
+			s = SchoolLoop('example', https=False, host=host(server), cookiejar=s.cookiejar,
+				response_cache=cache)
+			s.page('main')
+		assert server.stats['not_modified'] == 0, '%d not modified' % server.stats['not_modified']
+		assert cache.stats['stores'] == 0, '%d stored' % cache.stats['stores']
+	finally:
+		shutil.rmtree(directory)
+
+@check
+def latin1_smart_quotes(server):
+	"""
+	A page labelled ISO-8859-1 with windows-1252 smart quotes in it gets
+	them as entities with a trusted charset, in a tree and in a stream.
+	"""
+	raw = '<p>\x93hi\x94 \x96</p>'
+	expected = u'<p>&ldquo;hi&rdquo; &ndash;</p>'
+	soup = BeautifulSoup(raw, fromEncoding='ISO-8859-1', sniffEncoding=False)
+	assert unicode(soup.p) == expected, repr(unicode(soup.p))
+	class Handler(object):
+		def __init__(self):
+			self.found = []
+		def start(self, tag):
+			return tag.name == 'p'
+		def end(self, tag):
+			self.found.append(unicode(tag))
+	handler = Handler()
+	stream = SoupStream(handler, fromEncoding='ISO-8859-1')
+	for c in raw:
+		stream.feed(c)
+	stream.close()
+	assert handler.found == [expected], repr(handler.found)
+
+def main(args):
+	from optparse import OptionParser
+
+	parser = OptionParser(usage="usage: %prog [pattern ...]")
+	(options, patterns) = parser.parse_args(args)
+
+	failed = 0
+	for func in CHECKS:
+		if patterns and not any(re.search(pattern, func.__name__) for pattern in patterns):
+			continue
+		server = fakeserver.start(address=('127.0.0.1', 0))
+		schoolloop.TIMEZONES.invalidate()
+		try:
+			func(server)
+		except Exception:
+			failed += 1
+			print '%-40s FAIL' % func.__name__
+			traceback.print_exc()
+		else:
+			print '%-40s ok' % func.__name__
+		finally:
+			server.shutdown()
+			server.server_close()
+		sys.stdout.flush()
+	sys.exit(failed and 1 or 0)
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
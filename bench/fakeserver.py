@@ -0,0 +1,318 @@
+#!/usr/bin/python
+"""
+A local stand-in for a Schoolloop site, for testing connection pooling,
+concurrency and logging in again without hammering the real thing.
+
+It serves the fixture pages from bench/fixtures.py with the same logins,
+cookies and redirects the client expects, and can be told to be slow, to
+expire sessions, to fail some of the time and to serve bigger pages:
+
+	python bench/fakeserver.py --port 8080 --latency 300 --jitter 100 \\
+		--expiry 60 --error-rate 0.01 --size typical=0.9,pathological=0.1
+
+and point the client at it:
+
+	s = SchoolLoop('example', https=False, host='localhost:8080')
+
+Any username logs in, with any password unless --password is given. Each
+connection gets its own thread and connections are kept alive, so one
+server can stand in for a few thousand students.
+"""
+
+import os, sys, re, time, random, threading, hashlib, gzip, uuid, Cookie, urlparse
+import BaseHTTPServer, SocketServer
+from datetime import datetime
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fixtures import SIZES, render
+
+PAGES = {
+	'/portal/student_home' : 'main',
+	'/student/drop_box' : 'dropbox',
+	'/calendar/month' : 'calendar'
+}
+
+class Body(object):
+	"""
+	A rendered page, with its gzipped form and ETag worked out once.
+	"""
+	def __init__(self, html):
+		self.html = html
+		self.etag = '"%s"' % hashlib.md5(html).hexdigest()
+		buf = StringIO()
+		f = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6)
+		f.write(html)
+		f.close()
+		self.gzipped = buf.getvalue()
+
+class FakeSchoolLoop(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	"""
+	The server. Its options are attributes, so a test can change them while
+	it runs.
+
+	- address: (host, port) to listen on
+	- latency: milliseconds to wait before answering each request
+	- jitter: up to this many milliseconds more or less than latency
+	- expiry: seconds a session may sit idle before it is logged out, None
+	  to keep sessions forever
+	- error_rate: fraction of requests answered with a 500
+	- sizes: {size: weight} of the page sizes in bench/fixtures.py to serve
+	- password: the only password that logs in, None for any
+	- logout_settings: answer the calendar settings POST with the login
+	  redirect, as if every session expired right there
+	"""
+	daemon_threads = True
+	allow_reuse_address = True
+	request_queue_size = 1024
+
+	def __init__(self, address=('127.0.0.1', 8080), latency=0, jitter=0, expiry=None,
+			error_rate=0.0, sizes=None, password=None, logout_settings=False):
+		BaseHTTPServer.HTTPServer.__init__(self, address, FakeSchoolLoopHandler)
+		self.latency = latency
+		self.jitter = jitter
+		self.expiry = expiry
+		self.error_rate = error_rate
+		self.sizes = sizes or {'typical' : 1}
+		self.password = password
+		self.logout_settings = logout_settings
+		self.sessions = {} # session id -> session dict
+		self.bodies = {}
+		self.lock = threading.Lock()
+		self.stats = dict.fromkeys(['requests', 'logins', 'failed_logins', 'expired',
+			'errors', 'not_modified', 'bytes'], 0)
+
+	def count(self, stat, n=1):
+		with self.lock:
+			self.stats[stat] += n
+
+	def delay(self):
+		latency = self.latency + random.uniform(-self.jitter, self.jitter)
+		if latency > 0:
+			time.sleep(latency / 1000.0)
+
+	def pick_size(self):
+		point = random.uniform(0, sum(self.sizes.values()))
+		for size, weight in sorted(self.sizes.items()):
+			point -= weight
+			if point <= 0:
+				return size
+		return size
+
+	def body(self, page, size, year=None, month=None):
+		key = (page, size, year, month)
+		body = self.bodies.get(key)
+		if body is None:
+			body = self.bodies[key] = Body(render(page, size, year, month))
+		return body
+
+	def login(self, user):
+		"""
+		Starts a session and returns its id.
+		"""
+		sid = uuid.uuid4().hex
+		with self.lock:
+			self.sessions[sid] = {'user' : user, 'seen' : time.time(), 'all_events' : False}
+			self.stats['logins'] += 1
+		return sid
+
+	def session(self, sid):
+		"""
+		Returns the session with an id, or None if there is no such session
+		or it has expired.
+		"""
+		now = time.time()
+		with self.lock:
+			session = self.sessions.get(sid)
+			if session is None:
+				return None
+			if self.expiry is not None and now - session['seen'] > self.expiry:
+				del self.sessions[sid]
+				self.stats['expired'] += 1
+				return None
+			session['seen'] = now
+			return session
+
+	def expire_all(self):
+		"""
+		Logs out every session at once, like a server restart.
+		"""
+		with self.lock:
+			self.stats['expired'] += len(self.sessions)
+			self.sessions.clear()
+
+class FakeSchoolLoopHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	server_version = 'Apache-Coyote/1.1'
+
+	def log_message(self, *args):
+		pass
+
+	def send(self, code, body='', headers=()):
+		self.send_response(code)
+		for header in headers:
+			self.send_header(*header)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		if self.command != 'HEAD':
+			self.wfile.write(body)
+		self.server.count('bytes', len(body))
+
+	def redirect(self, path, headers=()):
+		self.send(302, headers=[('Location', 'http://%s%s' % (self.headers.get('Host', 'localhost'), path))] + list(headers))
+
+	def session_id(self):
+		cookie = Cookie.SimpleCookie()
+		try:
+			cookie.load(self.headers.get('Cookie', ''))
+		except Cookie.CookieError:
+			return None
+		return 'JSESSIONID' in cookie and cookie['JSESSIONID'].value or None
+
+	def do_GET(self):
+		server = self.server
+		server.count('requests')
+		length = int(self.headers.get('Content-Length') or 0)
+		data = length and self.rfile.read(length) or ''
+		url = urlparse.urlparse(self.path)
+		server.delay()
+
+		if server.error_rate and random.random() < server.error_rate:
+			server.count('errors')
+			return self.send(500, '<html><body><h1>HTTP Status 500</h1></body></html>',
+				[('Content-Type', 'text/html')])
+
+		if url.path == '/portal/login':
+			form = urlparse.parse_qs(data)
+			user = form.get('login_name', [''])[0]
+			password = form.get('password', [''])[0]
+			if not user or not password or (server.password is not None and password != server.password):
+				server.count('failed_logins')
+				return self.redirect('/portal/login?etarget=login_form&login_error=1')
+			sid = server.login(user)
+			return self.redirect('/portal/student_home', [('Set-Cookie', 'JSESSIONID=%s; Path=/' % sid)])
+
+		session = server.session(self.session_id())
+		if session is None or (server.logout_settings and url.path == '/calendar/setCalendarSettings'):
+			return self.redirect('/portal/login?d=x&return_url=%s' % url.path)
+
+		if url.path == '/calendar/setCalendarSettings':
+			session['all_events'] = True
+			return self.redirect('/calendar/month')
+
+		page = PAGES.get(url.path)
+		if page is None:
+			return self.send(404, '<html><body><h1>HTTP Status 404</h1></body></html>',
+				[('Content-Type', 'text/html')])
+
+		size = server.pick_size()
+		year = month = None
+		if page == 'calendar':
+			month_id = int(urlparse.parse_qs(url.query).get('month_id', ['0'])[0])
+			day = month_id and datetime.utcfromtimestamp(month_id / 1000) or datetime.now()
+			year, month = day.year, day.month
+			if not session['all_events']:
+				size = 'small' # only school events, which the fixtures don't have
+		body = server.body(page, size, year, month)
+
+		headers = [('Content-Type', 'text/html;charset=UTF-8'), ('ETag', body.etag),
+			('Cache-Control', 'private, no-cache')]
+		if self.headers.get('If-None-Match') == body.etag:
+			server.count('not_modified')
+			return self.send(304, headers=headers)
+		if re.search(r'\bgzip\b', self.headers.get('Accept-Encoding', '')):
+			return self.send(200, body.gzipped, headers + [('Content-Encoding', 'gzip')])
+		return self.send(200, body.html, headers)
+
+	do_POST = do_HEAD = do_GET
+
+def start(**options):
+	"""
+	Starts a FakeSchoolLoop on a background thread and returns it. Call
+	shutdown() on it when done.
+	"""
+	server = FakeSchoolLoop(**options)
+	thread = threading.Thread(target=server.serve_forever)
+	thread.daemon = True
+	thread.start()
+	return server
+
+def parse_sizes(value):
+	"""
+	Parses --size: a size name, or size=weight pairs separated by commas.
+	"""
+	sizes = {}
+	for part in value.split(','):
+		size, _, weight = part.partition('=')
+		if size not in SIZES:
+			raise ValueError('unknown page size %r, pick from %s' % (size, ', '.join(sorted(SIZES))))
+		sizes[size] = float(weight or 1)
+	return sizes
+
+def main(args):
+	from optparse import OptionParser
+
+	parser = OptionParser(usage="usage: %prog [options]")
+	parser.add_option("-b", "--bind",
+		action="store",
+		dest="bind",
+		default="127.0.0.1",
+		help="Address to listen on.")
+	parser.add_option("-p", "--port",
+		action="store",
+		type="int",
+		dest="port",
+		default=8080,
+		help="Port to listen on.")
+	parser.add_option("-l", "--latency",
+		action="store",
+		type="float",
+		dest="latency",
+		default=0,
+		help="Milliseconds to wait before answering each request.")
+	parser.add_option("-j", "--jitter",
+		action="store",
+		type="float",
+		dest="jitter",
+		default=0,
+		help="Vary the latency by up to this many milliseconds either way.")
+	parser.add_option("-x", "--expiry",
+		action="store",
+		type="float",
+		dest="expiry",
+		default=None,
+		help="Seconds a session may sit idle before it is logged out.")
+	parser.add_option("-e", "--error-rate",
+		action="store",
+		type="float",
+		dest="error_rate",
+		default=0.0,
+		help="Fraction of requests to answer with a 500.")
+	parser.add_option("-s", "--size",
+		action="store",
+		dest="size",
+		default="typical",
+		help="Page size to serve, or a weighted mix like typical=0.9,pathological=0.1.")
+	parser.add_option("--password",
+		action="store",
+		dest="password",
+		default=None,
+		help="The only password that logs in. By default any password does.")
+	(options, args) = parser.parse_args(args)
+
+	try:
+		sizes = parse_sizes(options.size)
+	except ValueError, e:
+		parser.error(str(e))
+	server = FakeSchoolLoop((options.bind, options.port), options.latency, options.jitter,
+		options.expiry, options.error_rate, sizes, options.password)
+	print "serving on http://%s:%d/" % server.server_address
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	print ', '.join('%s: %d' % item for item in sorted(server.stats.items()))
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
@@ -0,0 +1,215 @@
+#!/usr/bin/python
+"""
+Generates the HTML fixtures in bench/data.
+
+The pages are synthetic: they copy the markup that schoolloop.py's parsers
+rely on from the real Schoolloop pages, plus the usual navigation, script
+and footer chrome around it, but every name, grade and id is made up. The
+same functions are used to render pages on the fly for other months or
+sizes.
+
+Run it to rewrite the fixtures after changing the generators:
+
+	python bench/fixtures.py
+"""
+
+import calendar, random, os, sys
+from datetime import datetime, timedelta
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# standard UTC offset of the fixture school, Pacific time like the real one
+TIMEZONE = -8
+
+# (classes, assignments), dropbox files and events per day for each size
+SIZES = {
+	'small' : {'main' : (3, 2), 'dropbox' : 3, 'calendar' : 0},
+	'typical' : {'main' : (7, 25), 'dropbox' : 40, 'calendar' : 2},
+	'pathological' : {'main' : (40, 1500), 'dropbox' : 3000, 'calendar' : 40}
+}
+
+SUBJECTS = ['Algebra 2', 'AP Chemistry', 'English 11', 'US History', 'Spanish 3',
+	'Physical Education', 'Studio Art', 'AP Computer Science', 'Biology', 'Economics']
+
+HEAD = '''<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head>
+<meta http-equiv="Content-Type" content="text/html; charset=UTF-8" />
+<title>%(title)s - Example High School</title>
+<link rel="stylesheet" type="text/css" href="/css/portal.css" />
+<link rel="stylesheet" type="text/css" href="/css/print.css" media="print" />
+<script type="text/javascript" src="/js/prototype.js"></script>
+<script type="text/javascript">
+//<![CDATA[
+var sl_session = { portal: "student", locale: "en_US", tz: "America/Los_Angeles" };
+function toggleMenu(id) { var el = document.getElementById(id); if (el.style.display == 'none') { el.style.display = ''; } else { el.style.display = 'none'; } return false; }
+function popup(url) { window.open(url, 'sl_popup', 'width=640,height=480,scrollbars=yes'); return false; }
+//]]>
+</script>
+</head>
+<body class="portal">
+<div id="page_wrapper">
+<div id="header"><a href="/portal/student_home"><img src="/img/logo.gif" alt="School Loop" width="180" height="42" border="0"/></a>
+<div id="header_links">Welcome, Student A | <a href="/portal/settings">My Settings</a> | <a href="/portal/logout">Logout</a></div>
+</div>
+<div id="nav"><ul>
+<li><a href="/portal/student_home">My Loop</a></li>
+<li><a href="/student/drop_box">Drop Box</a></li>
+<li><a href="/calendar/month">Calendar</a></li>
+<li><a href="/mail/inbox">LoopMail</a></li>
+<li><a href="/portal/news">News</a></li>
+<li><a href="/portal/groups">Groups</a></li>
+</ul></div>
+'''
+
+FOOT = '''<div id="footer">
+<p>&copy; School Loop, Inc. All rights reserved. <a href="/portal/privacy">Privacy</a> | <a href="/portal/terms">Terms of Use</a> | <a href="/portal/help">Help</a></p>
+<!-- page rendered by app7 -->
+</div>
+</div>
+</body>
+</html>
+'''
+
+def day_id(day):
+	"""
+	Returns the day_id/month_id of local midnight on a day, in ms since the
+	epoch, following the US DST rules the client assumes.
+	"""
+	dst = 3 < day.month <= 10 or (day.month == 3 and day.day > 14) or (day.month == 11 and day.day <= 7)
+	utc = datetime(day.year, day.month, day.day) - timedelta(hours=TIMEZONE + (dst and 1 or 0))
+	return calendar.timegm(utc.timetuple()) * 1000
+
+def student_home(classes=7, assignments=25, seed=1):
+	"""
+	Renders /portal/student_home with a grades table and current assignments.
+	"""
+	rand = random.Random(seed)
+	out = [HEAD % {'title' : 'My Loop'}]
+	out.append('<div id="container_content">\n<table class="hub_general" cellpadding="0" cellspacing="0" width="100%">\n'
+		'<thead><tr><th class="left">Course</th><th>Grade</th><th>Teacher</th><th>Updated</th></tr></thead>\n'
+		'<tbody class="hub_general_body">\n')
+	for i in range(classes):
+		subject = SUBJECTS[i % len(SUBJECTS)]
+		if i % 5 == 4:
+			grade = '<td class="list_text"><a href="/progress_report/list?group_id=%d">Progress Report</a></td>' % (1000 + i)
+		else:
+			grade = '<td class="list_text"><img src="/img/spacer.gif" width="4" height="1" alt=""/>%s (%.1f%%)</td>' % (
+				rand.choice(['A', 'A-', 'B+', 'B', 'B-', 'C+']), rand.uniform(70, 100))
+		out.append('<tr class="%s">\n<td class="left"><a href="/course/home?group_id=%d&amp;d=x">%s</a></td>%s\n'
+			'<td class="list_text">Teacher %s</td>\n<td class="list_text">%d/%d/12</td>\n</tr>\n' % (
+			i % 2 and 'odd' or 'even', 1000 + i, subject, grade, chr(65 + i % 26), rand.randint(1, 12), rand.randint(1, 28)))
+	out.append('</tbody>\n</table>\n')
+
+	out.append('<div class="module"><div class="title">Current Assignments</div>'
+		'<table class="list" cellpadding="0" cellspacing="0" width="100%"><tbody>\n')
+	for i in range(assignments):
+		icon = ['<img src="/img/icons/new.gif" alt="new"/>', '<img src="/img/icons/due.gif" alt="due"/>', '&nbsp;'][i % 3]
+		subject = SUBJECTS[i % classes % len(SUBJECTS)]
+		out.append('<tr><td class="status">%s</td>'
+			'<td class="title"><div><a href="/course/assignment?id=%d">%s %d</a></div></td>'
+			'<td class="spacer"></td>'
+			'<td><div>%s Period %d</div></td>'
+			'<td><div>%02d/%02d/12</div></td>'
+			'<td class="spacer"></td></tr>\n' % (icon, 50000 + i,
+			rand.choice(['Homework', 'Problem Set', 'Reading', 'Lab Report', 'Essay', 'Quiz']), i + 1,
+			subject, i % classes % 7 + 1, i % 12 + 1, i % 28 + 1))
+	out.append('</tbody></table></div>\n</div>\n')
+	out.append(FOOT)
+	return ''.join(out)
+
+def drop_box(files=40, seed=2):
+	"""
+	Renders /student/drop_box with a list of turned in files.
+	"""
+	rand = random.Random(seed)
+	out = [HEAD % {'title' : 'Drop Box'}]
+	out.append('<div id="container_content">\n<table class="filter"><tr><td>Show: <select name="filter">'
+		'<option value="all">All Courses</option></select></td></tr></table>\n'
+		'<table class="list" cellpadding="0" cellspacing="0" width="100%">\n'
+		'<tr><th>Date</th><th>Course</th><th>Assignment</th><th>File</th></tr>\n')
+	for i in range(files):
+		out.append('<tr><td>%02d/%02d/12</td><td>%s</td>'
+			'<td><a href="/course/assignment?id=%d">%s %d</a></td>'
+			'<td><a href="/student/drop_box/file?id=%d">file_%d.%s</a></td></tr>\n' % (
+			i % 12 + 1, i % 28 + 1, SUBJECTS[i % len(SUBJECTS)], 50000 + i,
+			rand.choice(['Essay', 'Lab Report', 'Project']), i + 1, 90000 + i, i, rand.choice(['doc', 'pdf', 'txt'])))
+	out.append('</table>\n</div>\n')
+	out.append(FOOT)
+	return ''.join(out)
+
+def calendar_month(year=2012, month=10, events=2, seed=3):
+	"""
+	Renders /calendar/month for a month, with six weeks of days including
+	the greyed out ones from the months around it.
+	"""
+	rand = random.Random(seed)
+	first = datetime(year, month, 1)
+	out = [HEAD % {'title' : 'Calendar'}]
+	out.append('<div id="container_content">\n<div class="cal_nav">'
+		'<a href="/calendar/month?month_id=%d&amp;move=-1">&laquo; Previous</a> '
+		'<b>%s %d</b> '
+		'<a href="/calendar/month?month_id=%d&amp;move=1">Next &raquo;</a> '
+		'<a href="/calendar/month?month_id=0">Today</a></div>\n' % (
+		day_id(first), calendar.month_name[month], year, day_id(first)))
+	out.append('<table class="cal_table" cellpadding="0" cellspacing="0" width="100%">\n<tr>' +
+		''.join('<th class="cal_th">%s</th>' % day for day in ('Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat')) + '</tr>\n')
+	start = first - timedelta(days=(first.weekday() + 1) % 7)
+	for week in range(6):
+		out.append('<tr>')
+		for weekday in range(7):
+			day = start + timedelta(days=week * 7 + weekday)
+			color = day.month == month and '#000000' or '#888888'
+			out.append('<td class="cal_td" valign="top"><a href="/calendar/day?day_id=%d" class="cal_day_link">'
+				'<span style="color: %s;">%d</span></a>' % (day_id(day), color, day.day))
+			for i in range(events and rand.randint(0, events * 2) or 0):
+				course = i % 3 and '<b>%s</b> ' % SUBJECTS[(day.day + i) % len(SUBJECTS)] or ''
+				out.append('<div style="font-size: 10px; font-weight: bold;">%s<a id="%d" href="#" '
+					'onclick="return popup(\'/calendar/event?id=%d\');">%s %d</a></div>' % (
+					course, day_id(day) / 1000 + i, day_id(day) / 1000 + i,
+					rand.choice(['Quiz', 'Test', 'Field Trip', 'Project Due', 'Assembly', 'Club Meeting']), i + 1))
+			out.append('</td>')
+		out.append('</tr>\n')
+	out.append('</table>\n</div>\n')
+	out.append(FOOT)
+	return ''.join(out)
+
+def render(page, size='typical', year=2012, month=10):
+	"""
+	Renders one of the fixture pages: 'main', 'dropbox' or 'calendar'.
+	"""
+	if page == 'main':
+		return student_home(*SIZES[size]['main'])
+	elif page == 'dropbox':
+		return drop_box(SIZES[size]['dropbox'])
+	return calendar_month(year, month, SIZES[size]['calendar'])
+
+# file name -> (page, size, year, month)
+FIXTURES = {}
+for size in SIZES:
+	FIXTURES['student_home-%s.html' % size] = ('main', size, None, None)
+	FIXTURES['drop_box-%s.html' % size] = ('dropbox', size, None, None)
+	FIXTURES['calendar_month-%s.html' % size] = ('calendar', size, 2012, 10)
+# months whose grids start on a Sunday, span six weeks, or cross DST changes
+FIXTURES['calendar_month-typical-2012-03.html'] = ('calendar', 'typical', 2012, 3)
+FIXTURES['calendar_month-typical-2012-09.html'] = ('calendar', 'typical', 2012, 9)
+FIXTURES['calendar_month-typical-2012-11.html'] = ('calendar', 'typical', 2012, 11)
+FIXTURES['calendar_month-typical-2013-02.html'] = ('calendar', 'typical', 2013, 2)
+
+def fixture(name):
+	"""
+	Returns the contents of a fixture file in bench/data.
+	"""
+	with open(os.path.join(DATA_DIR, name), 'rb') as f:
+		return f.read()
+
+def main(args):
+	if not os.path.isdir(DATA_DIR):
+		os.makedirs(DATA_DIR)
+	for name, (page, size, year, month) in sorted(FIXTURES.items()):
+		with open(os.path.join(DATA_DIR, name), 'wb') as f:
+			f.write(render(page, size, year, month))
+		print '%-42s %8d bytes' % (name, os.path.getsize(os.path.join(DATA_DIR, name)))
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
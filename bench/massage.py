@@ -0,0 +1,77 @@
+#!/usr/bin/python
+"""
+Compares BeautifulSoup's markup massage settings on the fixtures: the usual
+two regex passes, COMBINED_MARKUP_MASSAGE's single pass, and none at all.
+For each fixture and setting it prints how long the massage alone and
+building the whole tree take, and whether the tree and everything the page
+parsers extract from it are the same as with the usual massage.
+
+	python bench/massage.py [-t seconds] [pattern ...]
+"""
+
+import re, sys
+
+from bench import EXTRACTORS, measure
+from fixtures import FIXTURES, fixture
+from BeautifulSoup import BeautifulSoup, UnicodeDammit
+
+MODES = [
+	('two passes', True),
+	('combined', BeautifulSoup.COMBINED_MARKUP_MASSAGE),
+	('off', False)
+]
+
+def massage_only(text, massage):
+	# what BeautifulStoneSoup._feed does before parsing
+	if massage is True:
+		massage = BeautifulSoup.MARKUP_MASSAGE
+	for fix, m in massage or []:
+		text = fix.sub(m, text)
+	return text
+
+def extract(page, soup):
+	results = []
+	for name, func in EXTRACTORS[page]:
+		try:
+			results.append(func(soup))
+		except Exception, e:
+			results.append('%s: %s' % (e.__class__.__name__, e))
+	return results
+
+def main(args):
+	from optparse import OptionParser
+
+	parser = OptionParser(usage="usage: %prog [options] [pattern ...]")
+	parser.add_option("-t", "--time",
+		action="store",
+		type="float",
+		dest="time",
+		default=0.5,
+		help="Seconds to time each setting for.")
+	(options, patterns) = parser.parse_args(args)
+
+	print '%-40s %-12s %10s %8s %9s %8s %6s %8s' % ('fixture', 'massage', 'massage ms', 'vs two',
+		'parse ms', 'vs two', 'tree', 'extract')
+	for name in sorted(FIXTURES):
+		if patterns and not any(re.search(pattern, name) for pattern in patterns):
+			continue
+		page = FIXTURES[name][0]
+		# decoded first, as SchoolLoopPage does
+		text = UnicodeDammit(fixture(name), smartQuotesTo=BeautifulSoup.HTML_ENTITIES, isHTML=True).unicode
+
+		expected = None
+		for label, massage in MODES:
+			soup = BeautifulSoup(text, markupMassage=massage)
+			tree, extracted = unicode(soup), extract(page, soup)
+			alone = measure(lambda massage=massage: (lambda: massage_only(text, massage)), options.time / 4)
+			result = measure(lambda massage=massage: (lambda: BeautifulSoup(text, markupMassage=massage)), options.time)
+			if expected is None:
+				expected = (tree, extracted, alone['p50'], result['p50'])
+			print '%-40s %-12s %10.3f %+7.1f%% %9.3f %+7.1f%% %6s %8s' % (name, label,
+				alone['p50'] * 1000, (alone['p50'] / expected[2] - 1) * 100,
+				result['p50'] * 1000, (result['p50'] / expected[3] - 1) * 100,
+				tree == expected[0] and 'same' or 'DIFF', extracted == expected[1] and 'same' or 'DIFF')
+			sys.stdout.flush()
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+"""
+Measures how much memory a parsed page takes as a normal soup and as a
+compact one (see BeautifulStoneSoup's compact option). For each fixture and
+mode it prints the bytes held by the tree's nodes and everything they refer
+to, counting strings shared between nodes once, and what keeping --copies
+parsed copies of the page adds to the RSS of a forked child, per copy.
+
+	python bench/memory.py                  # the calendar fixtures
+	python bench/memory.py [-n copies] [pattern ...]
+"""
+
+import os, sys, re, gc, resource, cPickle
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fixtures import FIXTURES, fixture
+from BeautifulSoup import BeautifulSoup, PageElement
+
+MODES = [
+	('normal', False),
+	('compact', True)
+]
+
+def tree_bytes(soup):
+	"""
+	Returns (nodes, bytes) for the elements under soup: the elements
+	themselves, plus any dicts, lists, tuples and strings they hold.
+	"""
+	elements = list(soup.recursiveChildGenerator())
+	seen = set(id(element) for element in elements)
+	total = 0
+	stack = list(elements)
+	while stack:
+		obj = stack.pop()
+		total += sys.getsizeof(obj)
+		for ref in gc.get_referents(obj):
+			if id(ref) in seen or isinstance(ref, PageElement) \
+					or not isinstance(ref, (dict, list, tuple, basestring)):
+				continue
+			seen.add(id(ref))
+			stack.append(ref)
+	return len(elements), total
+
+def rss():
+	"""
+	Returns the resident set size in KB: the current one where /proc says,
+	otherwise the peak.
+	"""
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * resource.getpagesize() / 1024
+	except IOError:
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def rss_per_copy(html, compact, copies):
+	"""
+	Parses copies of html in a forked child and keeps them all. Returns
+	the KB of RSS each one added.
+	"""
+	read, write = os.pipe()
+	pid = os.fork()
+	if pid == 0:
+		os.close(read)
+		BeautifulSoup(html, compact=compact) # warm up
+		gc.collect()
+		start = rss()
+		soups = [BeautifulSoup(html, compact=compact) for i in range(copies)]
+		result = (rss() - start) / float(copies)
+		os.write(write, cPickle.dumps(result, 2))
+		os._exit(0)
+	os.close(write)
+	data = os.read(read, 65536)
+	os.close(read)
+	os.waitpid(pid, 0)
+	return cPickle.loads(data)
+
+def main(args):
+	from optparse import OptionParser
+
+	parser = OptionParser(usage="usage: %prog [options] [pattern ...]")
+	parser.add_option("-n", "--copies",
+		action="store",
+		type="int",
+		dest="copies",
+		default=20,
+		help="Copies of each page to keep for the RSS measurement.")
+	(options, patterns) = parser.parse_args(args)
+	patterns = patterns or ['^calendar_month']
+
+	print '%-40s %-8s %7s %10s %10s %8s %12s %8s' % ('fixture', 'mode', 'nodes', 'tree KB',
+		'bytes/node', 'vs normal', 'RSS KB/copy', 'vs normal')
+	for name in sorted(FIXTURES):
+		if not any(re.search(pattern, name) for pattern in patterns):
+			continue
+		html = fixture(name)
+		expected = None
+		for label, compact in MODES:
+			nodes, size = tree_bytes(BeautifulSoup(html, compact=compact))
+			kb = rss_per_copy(html, compact, options.copies)
+			if expected is None:
+				expected = (size, kb)
+			print '%-40s %-8s %7d %10.1f %10.1f %+7.1f%% %12.1f %+7.1f%%' % (name, label, nodes,
+				size / 1024.0, size / float(nodes), (float(size) / expected[0] - 1) * 100,
+				kb, expected[1] and (kb / expected[1] - 1) * 100)
+			sys.stdout.flush()
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
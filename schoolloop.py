@@ -1,7 +1,7 @@
 #!/usr/bin/python
 
-import re, cookielib, threading, calendar, urllib, urllib2, time, sys, os
-from BeautifulSoup import BeautifulSoup
+import re, codecs, cookielib, threading, Queue, collections, hashlib, cPickle, tempfile, zlib, calendar, urllib, urllib2, httplib, socket, time, sys, os
+from BeautifulSoup import BeautifulSoup, NavigableString, SoupStrainer, CompiledStrainer, SoupStream, StopParsing, UnicodeDammit
 from datetime import datetime, date as datedate # date conflicts too easily
 
 PAGE_TABLE = {
@@ -10,38 +10,826 @@ PAGE_TABLE = {
 	'calendar' : '/calendar/month'
 }
 
+# what to do when a request gets redirected, see SchoolLoop.open()
+REDIRECT_FOLLOW = 0 # follow redirects as usual
+REDIRECT_LOGIN = 1 # "success" or "fail" depending on where a login redirects to
+REDIRECT_STOP = 2 # stop and return the redirect target
+
+# the part of a page each parser needs; only that much gets turned into a
+# tree (see SchoolLoopPage.region). The calendar page has none: its table
+# is most of the page, so straining costs as much as building the whole
+# tree, and the whole tree serves parse_timezone as well.
+REGIONS = {
+	'classes' : SoupStrainer('tbody', { 'class' : 'hub_general_body' }),
+	'dropbox' : SoupStrainer('div', { 'id' : 'container_content' })
+}
+
+# the queries the page parsers run, worked out once instead of on every call
+QUERIES = {
+	'classes' : CompiledStrainer('tbody', { 'class' : 'hub_general_body' }),
+	'class_link' : CompiledStrainer('td', { 'class' : 'left' }),
+	'assignments' : CompiledStrainer(lambda tag: tag.string and tag.string.find('Current Assignments') != -1,
+		{ 'class' : 'title' }),
+	'dropbox' : CompiledStrainer('div', { 'id' : 'container_content' }),
+	'calendar' : CompiledStrainer('table', { 'class' : 'cal_table' }),
+	'calendar_day' : CompiledStrainer('td', { 'class' : 'cal_td' }),
+	'calendar_event' : CompiledStrainer('div', style='font-size: 10px; font-weight: bold;'),
+	'month_links' : CompiledStrainer('a', href=re.compile('month_id=[^0]'))
+}
+
+# content encodings we can decompress, see read_body()
+ACCEPT_ENCODING = 'gzip, deflate'
+
+# calendar filter that shows every kind of event
+CALENDAR_SETTINGS = 'assigned=true&due=true&public=true&ugroups=true&uevents=true&x=0&y=0'
+
+# the cookie Schoolloop keeps the session in
+SESSION_COOKIE = 'JSESSIONID'
+
 class PickleJar(cookielib.CookieJar, object):
+	def __init__(self, policy=None):
+		cookielib.CookieJar.__init__(self, policy)
+		self.calendarSession = None # the session the calendar filter was set for
 	def __getstate__(self):
 		state = self.__dict__.copy()
 		del state['_cookies_lock']
 		return state
 	def __setstate__(self, state):
+		state.setdefault('calendarSession', None)
 		self.__dict__ = state
 		self._cookies_lock = threading.RLock()
 
+def session_cookie(cookiejar):
+	"""
+	Returns the value of the session cookie in cookiejar, or None.
+	"""
+	for cookie in cookiejar:
+		if cookie.name == SESSION_COOKIE:
+			return cookie.value
+	return None
+
+class SchoolLoopError(Exception):
+	pass
+
+class LoginError(SchoolLoopError):
+	"""
+	Raised when the session has expired and logging in again failed.
+	"""
+	pass
+
+def threaded_map(func, items, workers=4):
+	"""
+	Like map(), but calls func on up to `workers` threads at once.
+	The first exception raised by func is re-raised in the caller.
+	"""
+	items = list(items)
+	results = [None] * len(items)
+	errors = []
+	queue = Queue.Queue()
+	for job in enumerate(items):
+		queue.put(job)
+	
+	def worker():
+		while True:
+			try:
+				i, item = queue.get_nowait()
+			except Queue.Empty:
+				return
+			try:
+				results[i] = func(item)
+			except Exception:
+				errors.append(sys.exc_info())
+	
+	threads = [threading.Thread(target=worker) for i in range(min(workers, len(items)))]
+	for thread in threads:
+		thread.daemon = True
+		thread.start()
+	for thread in threads:
+		thread.join()
+	if errors:
+		raise errors[0][0], errors[0][1], errors[0][2]
+	return results
+
+class PageCache(object):
+	"""
+	LRU cache of SchoolLoopPage objects keyed by (page, params). Entries
+	expire after a time to live that can differ per page keyword, and the
+	least recently used ones are evicted once the cache holds more than
+	max_entries pages or more than max_bytes of page data.
+	"""
+	def __init__(self, ttl=None, default_ttl=None, max_entries=None, max_bytes=None):
+		"""
+		- ttl: dict of page keyword to seconds, e.g. {'main': 60, 'calendar': 3600}
+		- default_ttl: seconds for pages not in ttl, None to keep them forever
+		- max_entries: maximum number of pages kept
+		- max_bytes: maximum total size of the downloaded pages kept
+		"""
+		self.ttl = ttl or {}
+		self.default_ttl = default_ttl
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+		self.lock = threading.Lock()
+		self.entries = collections.OrderedDict()
+		self.bytes = 0
+		self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+	def get(self, key):
+		"""
+		Returns the cached page for key, or None.
+		"""
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is None:
+				self.stats['misses'] += 1
+				return None
+			if entry[1] is not None and entry[1] < time.time():
+				# stays around for stale() until it is replaced or evicted
+				self.stats['expirations'] += 1
+				self.stats['misses'] += 1
+				return None
+			self.entries[key] = self.entries.pop(key)
+			self.stats['hits'] += 1
+			return entry[0]
+
+	def stale(self, key):
+		"""
+		Returns the cached page for key even if it has expired, or None.
+		"""
+		with self.lock:
+			entry = self.entries.get(key)
+			return entry and entry[0]
+
+	def put(self, key, page):
+		"""
+		Caches a page, evicting the least recently used ones if needed.
+		"""
+		ttl = self.ttl.get(key[0], self.default_ttl)
+		size = page.size
+		with self.lock:
+			old = self.entries.pop(key, None)
+			if old is not None:
+				self.bytes -= old[2]
+			self.entries[key] = (page, ttl is not None and time.time() + ttl or None, size)
+			self.bytes += size
+			while len(self.entries) > 1 and ((self.max_entries is not None and len(self.entries) > self.max_entries)
+					or (self.max_bytes is not None and self.bytes > self.max_bytes)):
+				key, entry = self.entries.popitem(last=False)
+				self.bytes -= entry[2]
+				self.stats['evictions'] += 1
+
+	def invalidate(self, page, params=None, all_params=False):
+		"""
+		Drops a page from the cache.
+		
+		- page: page keyword (see PAGE_TABLE)
+		- params: GET params
+		- all_params: drop the page for every value of params, e.g. every calendar month
+		"""
+		with self.lock:
+			for key in self.entries.keys():
+				if key[0] == page and (all_params or key[1] == params):
+					self.bytes -= self.entries.pop(key)[2]
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+			self.bytes = 0
+
+	def __contains__(self, key):
+		with self.lock:
+			entry = self.entries.get(key)
+			return entry is not None and (entry[1] is None or entry[1] >= time.time())
+
+	def keys(self):
+		with self.lock:
+			return self.entries.keys()
+
+	def __iter__(self):
+		return iter(self.keys())
+
+	def __len__(self):
+		return len(self.entries)
+
+def save_pickle(filename, obj):
+	"""
+	Pickles obj to filename through a temporary file in the same directory,
+	so readers never see half a file. Like every file mkstemp makes, it is
+	readable by this user only.
+	"""
+	fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)))
+	with os.fdopen(fd, 'wb') as f:
+		cPickle.dump(obj, f, 2)
+	os.rename(tmp, filename)
+
+class ResponseCache(object):
+	"""
+	Keeps downloaded pages on disk along with their ETag, Last-Modified and
+	Date headers, so that after a restart they can be revalidated with a
+	conditional request instead of downloaded again.
+	"""
+	def __init__(self, directory):
+		"""
+		- directory: where to keep the cached pages, created if needed
+		"""
+		self.directory = directory
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+		self.stats = {'revalidated': 0, 'misses': 0, 'stores': 0}
+
+	def filename(self, key):
+		return os.path.join(self.directory, hashlib.sha1(repr(key)).hexdigest())
+
+	def get(self, key):
+		"""
+		Returns the stored entry for key, a dict with the body, its validators
+		and its charset, or None.
+		"""
+		try:
+			with open(self.filename(key), 'rb') as f:
+				return cPickle.load(f)
+		except (IOError, EOFError, cPickle.UnpicklingError):
+			return None
+
+	def put(self, key, headers, body):
+		"""
+		Stores a response body with the validators from its headers.
+		"""
+		entry = {
+			'etag': headers.get('etag'),
+			'last_modified': headers.get('last-modified'),
+			'date': headers.get('date'),
+			'charset': headers.getparam('charset'),
+			'body': body
+		}
+		save_pickle(self.filename(key), entry)
+		self.stats['stores'] += 1
+
+	def conditional_headers(self, entry):
+		"""
+		Returns the request headers that revalidate a stored entry.
+		"""
+		headers = {}
+		if entry['etag']:
+			headers['If-None-Match'] = entry['etag']
+		# without Last-Modified, the Date of the stored response will do
+		if entry['last_modified'] or entry['date']:
+			headers['If-Modified-Since'] = entry['last_modified'] or entry['date']
+		return headers
+
+	def invalidate(self, key):
+		try:
+			os.remove(self.filename(key))
+		except OSError:
+			pass
+
+class TimezoneCache(object):
+	"""
+	The UTC offset parse_timezone() works out for each subdomain, so the
+	calendar page is downloaded and parsed for it once rather than once per
+	SchoolLoop object. Given a filename, the offsets are kept there too and
+	shared with every process using the same file. Safe to share between
+	threads and SchoolLoop objects.
+	"""
+	def __init__(self, filename=None, ttl=None):
+		"""
+		- filename: file to keep the offsets in, created if needed
+		- ttl: seconds before an offset is worked out again, None to keep
+		  it until it is invalidated
+		"""
+		self.filename = filename
+		self.ttl = ttl
+		self.lock = threading.Lock()
+		self.entries = {} # subdomain: (timezone, time found)
+		self.mtime = None
+		self.stats = {'hits': 0, 'misses': 0, 'stores': 0}
+
+	def load(self):
+		# picks up what other processes stored since the file was last read
+		try:
+			mtime = os.stat(self.filename).st_mtime
+		except OSError:
+			self.entries, self.mtime = {}, None
+			return
+		if mtime == self.mtime:
+			return
+		try:
+			with open(self.filename, 'rb') as f:
+				self.entries = cPickle.load(f)
+		except (IOError, EOFError, cPickle.UnpicklingError):
+			self.entries = {}
+		self.mtime = mtime
+
+	def save(self):
+		directory = os.path.dirname(os.path.abspath(self.filename))
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+		save_pickle(self.filename, self.entries)
+		self.mtime = os.stat(self.filename).st_mtime
+
+	def get(self, subdomain):
+		"""
+		Returns the UTC offset stored for subdomain, or None.
+		"""
+		with self.lock:
+			if self.filename:
+				self.load()
+			entry = self.entries.get(subdomain)
+			if entry is None or (self.ttl is not None and entry[1] + self.ttl < time.time()):
+				self.stats['misses'] += 1
+				return None
+			self.stats['hits'] += 1
+			return entry[0]
+
+	def put(self, subdomain, timezone):
+		"""
+		Stores the UTC offset of subdomain.
+		"""
+		with self.lock:
+			if self.filename:
+				self.load()
+			self.entries[subdomain] = (timezone, time.time())
+			if self.filename:
+				self.save()
+			self.stats['stores'] += 1
+
+	def invalidate(self, subdomain=None):
+		"""
+		Forgets the UTC offset of subdomain, or of every subdomain, so it is
+		worked out again from the calendar page.
+		"""
+		with self.lock:
+			if self.filename:
+				self.load()
+			if subdomain is None:
+				self.entries.clear()
+			else:
+				self.entries.pop(subdomain, None)
+			if self.filename:
+				self.save()
+
+class SessionStore(object):
+	"""
+	Keeps the cookies of logged in sessions on disk, keyed by subdomain and
+	user, so a later run can resume() a session instead of logging in
+	again. The files hold live session cookies, so only the user running
+	this can read them.
+	"""
+	def __init__(self, directory):
+		"""
+		- directory: where to keep the sessions, created if needed
+		"""
+		self.directory = directory
+		if not os.path.isdir(directory):
+			os.makedirs(directory, 0700)
+		self.stats = {'loads': 0, 'misses': 0, 'saves': 0}
+
+	def filename(self, subdomain, user):
+		return os.path.join(self.directory, hashlib.sha1(repr((subdomain, user))).hexdigest())
+
+	def load(self, subdomain, user):
+		"""
+		Returns the saved session of user, a dict with its cookies and the
+		session the calendar filter was set for, or None.
+		"""
+		try:
+			with open(self.filename(subdomain, user), 'rb') as f:
+				session = cPickle.load(f)
+		except (IOError, EOFError, cPickle.UnpicklingError):
+			self.stats['misses'] += 1
+			return None
+		self.stats['loads'] += 1
+		return session
+
+	def save(self, subdomain, user, cookiejar):
+		"""
+		Saves the session in cookiejar as user's.
+		"""
+		session = {
+			'cookies': list(cookiejar),
+			'calendar_session': getattr(cookiejar, 'calendarSession', None)
+		}
+		# save_pickle makes it readable by this user only
+		save_pickle(self.filename(subdomain, user), session)
+		self.stats['saves'] += 1
+
+	def invalidate(self, subdomain, user):
+		try:
+			os.remove(self.filename(subdomain, user))
+		except OSError:
+			pass
+
+def resume_session(loop, user):
+	"""
+	Copies the session of user saved in loop.sessionStore into loop's
+	cookie jar. Returns False if there isn't one.
+	"""
+	session = loop.sessionStore and loop.sessionStore.load(loop.subdomain, user)
+	if not session:
+		return False
+	for cookie in session['cookies']:
+		loop.cookiejar.set_cookie(cookie)
+	loop.cookiejar.calendarSession = session['calendar_session']
+	return True
+
+# shared by every SchoolLoop and AsyncSchoolLoop not given a timezone_cache
+TIMEZONES = TimezoneCache()
+
+def read_body(response, chunk_size=16384):
+	"""
+	Reads a response body, decompressing gzip or deflate content encoding as
+	it arrives. Returns (body, number of bytes that came over the wire).
+	"""
+	encoding = response.info().get('content-encoding', '').lower()
+	decompressor = None
+	if encoding in ('gzip', 'x-gzip'):
+		decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+	elif encoding == 'deflate':
+		decompressor = zlib.decompressobj()
+	
+	chunks = []
+	wire = 0
+	while True:
+		chunk = response.read(chunk_size)
+		if not chunk:
+			break
+		wire += len(chunk)
+		if decompressor:
+			try:
+				chunk = decompressor.decompress(chunk)
+			except zlib.error:
+				if encoding != 'deflate' or wire != len(chunk):
+					raise
+				# some servers send deflate without the zlib header
+				decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+				chunk = decompressor.decompress(chunk)
+		chunks.append(chunk)
+	if decompressor:
+		chunks.append(decompressor.flush())
+	return ''.join(chunks), wire
+
+class ConnectionPool(object):
+	"""
+	Keeps idle HTTP/1.1 connections around so they can be reused, saving
+	a TCP+TLS handshake per request. Connections are keyed by (scheme, host).
+	A pool can be shared by several SchoolLoop objects.
+	"""
+	def __init__(self, maxsize=4, idle_timeout=30):
+		"""
+		- maxsize: maximum number of idle connections kept per host
+		- idle_timeout: seconds an idle connection is kept before being dropped
+		"""
+		self.maxsize = maxsize
+		self.idle_timeout = idle_timeout
+		self.lock = threading.Lock()
+		self.idle = {}
+		self.stats = {'created': 0, 'reused': 0, 'expired': 0, 'discarded': 0}
+
+	def get(self, key):
+		"""
+		Returns an idle connection for key, or None if there isn't one.
+		"""
+		now = time.time()
+		with self.lock:
+			conns = self.idle.get(key)
+			while conns:
+				conn, since = conns.pop()
+				if now - since <= self.idle_timeout:
+					self.stats['reused'] += 1
+					return conn
+				# everything older than this one has expired as well
+				conns.append((conn, since))
+				self.stats['expired'] += len(conns)
+				for conn, since in conns:
+					conn.close()
+				del conns[:]
+		return None
+
+	def put(self, key, conn):
+		"""
+		Returns a connection to the pool once its response has been read.
+		"""
+		with self.lock:
+			conns = self.idle.setdefault(key, [])
+			if len(conns) < self.maxsize:
+				conns.append((conn, time.time()))
+				return
+			self.stats['discarded'] += 1
+		conn.close()
+
+	def created(self):
+		with self.lock:
+			self.stats['created'] += 1
+
+	def reuse_ratio(self):
+		"""
+		Fraction of requests that went out on an already open connection.
+		"""
+		with self.lock:
+			total = self.stats['created'] + self.stats['reused']
+			return total and float(self.stats['reused']) / total or 0.0
+
+	def close(self):
+		"""
+		Closes every idle connection.
+		"""
+		with self.lock:
+			for conns in self.idle.values():
+				for conn, since in conns:
+					conn.close()
+			self.idle.clear()
+
+class PooledResponse(object):
+	"""
+	Wraps an httplib response so its connection goes back to the pool once
+	the body has been read, or is closed if the body was abandoned.
+	"""
+	def __init__(self, pool, key, conn, response):
+		self.pool = pool
+		self.key = key
+		self.conn = conn
+		self.response = response
+	def read(self, amt=None):
+		data = self.response.read(amt)
+		if self.response.isclosed():
+			self.release()
+		return data
+	recv = read
+	def release(self):
+		if self.conn is None:
+			return
+		if self.response.will_close:
+			self.conn.close()
+		else:
+			self.pool.put(self.key, self.conn)
+		self.conn = None
+	def close(self):
+		if not self.response.isclosed():
+			self.response.close()
+			if self.conn is not None:
+				self.conn.close()
+				self.conn = None
+		self.release()
+
+class KeepAliveHandler(urllib2.HTTPHandler, urllib2.HTTPSHandler):
+	"""
+	HTTP/HTTPS handler that sends requests over connections from a
+	ConnectionPool instead of opening a new one every time.
+	"""
+	def __init__(self, pool, context=None):
+		urllib2.HTTPSHandler.__init__(self, context=context)
+		self.pool = pool
+
+	def http_open(self, req):
+		return self.do_keepalive_open(httplib.HTTPConnection, req)
+
+	def https_open(self, req):
+		return self.do_keepalive_open(httplib.HTTPSConnection, req, context=self._context)
+
+	def do_keepalive_open(self, http_class, req, **conn_args):
+		host = req.get_host()
+		if not host:
+			raise urllib2.URLError('no host given')
+		key = (req.get_type(), host)
+
+		headers = dict(req.unredirected_hdrs)
+		headers.update(dict((k, v) for k, v in req.headers.items() if k not in headers))
+		headers = dict((name.title(), val) for name, val in headers.items())
+		headers['Connection'] = 'keep-alive'
+
+		response = None
+		conn = self.pool.get(key)
+		if conn is not None:
+			try:
+				response = self._send(conn, req, headers)
+			except (socket.error, httplib.HTTPException):
+				# the server closed the idle connection on us, try a fresh one
+				conn.close()
+		connect_time = 0.0
+		if response is None:
+			conn = http_class(host, timeout=req.timeout, **conn_args)
+			self.pool.created()
+			try:
+				start = time.time()
+				conn.connect()
+				connect_time = time.time() - start
+				response = self._send(conn, req, headers)
+			except (socket.error, httplib.HTTPException), err:
+				conn.close()
+				raise urllib2.URLError(err)
+
+		fp = socket._fileobject(PooledResponse(self.pool, key, conn, response), close=True)
+		resp = urllib.addinfourl(fp, response.msg, req.get_full_url())
+		resp.code = response.status
+		resp.msg = response.reason
+		resp.connect_time = connect_time # DNS, TCP and TLS, 0 for a reused connection
+		return resp
+
+	def _send(self, conn, req, headers):
+		conn.request(req.get_method(), req.get_selector(), req.data, headers)
+		return conn.getresponse(buffering=True)
+
+class RequestLimiter(object):
+	"""
+	Limits the requests that the SchoolLoop objects sharing it send to the
+	server: at most max_requests waiting for a response at once, and at
+	most rate new ones a second. A request holds its place until its
+	response headers arrive.
+	"""
+	def __init__(self, max_requests=None, rate=None):
+		"""
+		- max_requests: most requests at once, None for no limit
+		- rate: most requests a second, None for no limit
+		"""
+		self.slots = max_requests and threading.BoundedSemaphore(max_requests)
+		self.interval = rate and 1.0 / rate
+		self.lock = threading.Lock()
+		self.next = 0 # when the next request may start
+		self.stats = {'requests': 0, 'delayed': 0}
+
+	def __enter__(self):
+		if self.slots:
+			self.slots.acquire()
+		now = time.time()
+		with self.lock:
+			self.stats['requests'] += 1
+			start = now
+			if self.interval:
+				start = max(now, self.next)
+				self.next = start + self.interval
+			if start > now:
+				self.stats['delayed'] += 1
+		if start > now:
+			time.sleep(start - now)
+		return self
+
+	def __exit__(self, *exc_info):
+		if self.slots:
+			self.slots.release()
+
+class Histogram(object):
+	"""
+	Counts durations in buckets that double in width from 0.1 ms up to
+	about two minutes, so it stays the same size however much it's fed.
+	"""
+	BOUNDS = [0.0001 * 2 ** i for i in range(21)]
+
+	def __init__(self):
+		self.counts = [0] * (len(self.BOUNDS) + 1)
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+
+	def add(self, value):
+		i = 0
+		while i < len(self.BOUNDS) and value > self.BOUNDS[i]:
+			i += 1
+		self.counts[i] += 1
+		self.count += 1
+		self.total += value
+		self.max = max(self.max, value)
+
+	def percentile(self, p):
+		"""
+		Returns the upper bound of the bucket holding the p-th percentile.
+		"""
+		seen = 0
+		for i, count in enumerate(self.counts):
+			seen += count
+			if seen and seen >= self.count * p / 100.0:
+				return i < len(self.BOUNDS) and min(self.BOUNDS[i], self.max) or self.max
+		return 0.0
+
+class Metrics(object):
+	"""
+	Collects the events SchoolLoop reports when given metrics=, keeping a
+	Histogram of every phase and totals of bytes, cache hits, redirects
+	and logins. Call dump() to print them. Safe to share between threads
+	and SchoolLoop objects.
+	
+	The events are dicts with an 'event' key:
+	- page: one page() call. page, url, cache ('hit', 'miss',
+	  'revalidated', or 'shared' when AsyncSchoolLoop waited on a fetch
+	  already under way), redirect (where it was redirected to, or None),
+	  relogin, bytes, wire_bytes, time, and the phases of the download:
+	  connect (only for pooled connections, otherwise part of wait),
+	  wait (sending the request until the headers arrive) and download
+	- decode: the page decoded to unicode. url, bytes, encoding, time
+	- parse: a tree built from the page. url, region (None for the
+	  whole page), time
+	- extract: a page parser run over a tree. url, extractor, items, time
+	"""
+	PHASES = ('connect', 'wait', 'download')
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.histograms = {}
+		self.counters = collections.defaultdict(int)
+
+	def __call__(self, event):
+		kind = event['event']
+		with self.lock:
+			if kind == 'page':
+				self.add('page', event['time'])
+				for phase in self.PHASES:
+					if phase in event:
+						self.add('page.%s' % phase, event[phase])
+				self.counters['pages'] += 1
+				self.counters['cache_%s' % event['cache']] += 1
+				self.counters['bytes'] += event['bytes']
+				self.counters['wire_bytes'] += event['wire_bytes']
+				if event['redirect']:
+					self.counters['redirects'] += 1
+				if event['relogin']:
+					self.counters['relogins'] += 1
+			elif kind == 'parse':
+				self.add('parse.%s' % (event['region'] or 'page'), event['time'])
+			elif kind == 'extract':
+				self.add('extract.%s' % event['extractor'], event['time'])
+			else:
+				self.add(kind, event['time'])
+
+	def add(self, name, value):
+		if name not in self.histograms:
+			self.histograms[name] = Histogram()
+		self.histograms[name].add(value)
+
+	def dump(self, out=None, bars=False):
+		"""
+		Prints a line per phase with its count and times in milliseconds,
+		then the totals.
+		
+		- out: file to write to, defaults to stdout
+		- bars: also draw each histogram
+		"""
+		out = out or sys.stdout
+		with self.lock:
+			out.write('%-24s %7s %9s %9s %9s %9s %9s\n' % ('phase', 'count', 'mean', 'p50', 'p90', 'p99', 'max'))
+			for name, hist in sorted(self.histograms.items()):
+				out.write('%-24s %7d %9.2f %9.2f %9.2f %9.2f %9.2f\n' % (name, hist.count,
+					hist.total / hist.count * 1000, hist.percentile(50) * 1000, hist.percentile(90) * 1000,
+					hist.percentile(99) * 1000, hist.max * 1000))
+				if bars:
+					widest = max(hist.counts)
+					for i, count in enumerate(hist.counts):
+						if count:
+							bound = i < len(hist.BOUNDS) and '<= %.1f ms' % (hist.BOUNDS[i] * 1000) or '>  %.1f ms' % (hist.BOUNDS[-1] * 1000)
+							out.write('  %14s %-40s %d\n' % (bound, '#' * max(1, count * 40 / widest), count))
+			out.write(', '.join('%s: %d' % item for item in sorted(self.counters.items())) + '\n')
+
 class SchoolLoop(object):
-	def __init__ (self, subdomain, https=True, cookiejar=None):
+	def __init__ (self, subdomain, https=True, cookiejar=None, pool=None, credentials=None,
+			page_cache=None, response_cache=None, host=None, metrics=None, trust_charset=True,
+			markup_massage=BeautifulSoup.COMBINED_MARKUP_MASSAGE, compact_soup=False, timezone_cache=None,
+			limiter=None, session_store=None):
 		"""
 		Initializes the SchoolLoop object.
 		
 		- subdomain: subdomain on Schoolloop website (https://<subdomain>.schoolloop.com/)
 		- https: set to False to disable https, enables debugging via Wireshark, etc.
 		- cookiejar: cookiejar from previous session to speed up login
+		- pool: ConnectionPool to keep connections alive between requests,
+		  True for a private pool with default settings
+		- credentials: (username, password), or a function returning them, used
+		  to log in again when the session expires. login() sets this too.
+		- page_cache: PageCache for downloaded pages, by default one that keeps
+		  every page until it is invalidated
+		- response_cache: ResponseCache to keep pages on disk between runs.
+		  Only used once the user is known, from login() or resume().
+		- host: host[:port] to talk to instead of <subdomain>.schoolloop.com,
+		  e.g. a local server like bench/fakeserver.py
+		- metrics: function called with a dict for every page fetched, decoded,
+		  parsed or extracted, e.g. a Metrics object; see Metrics for the events
+		- trust_charset: decode pages with the charset in their Content-Type
+		  header without sniffing the page for one. Like a browser, pages
+		  labelled Latin-1 or ASCII are read as windows-1252. Set to False
+		  for a server that mislabels its pages.
+		- markup_massage: markupMassage for every tree built from a page. The
+		  default does BeautifulSoup's usual fixes in one pass, True does them
+		  in two, False skips them for pages known not to need them.
+		- compact_soup: build compact trees (see BeautifulStoneSoup), which
+		  take about a third less memory while pages sit in page_cache, but
+		  can only be changed through methods like append(), not by
+		  changing tag.contents or tag.attrs in place
+		- timezone_cache: TimezoneCache for the server's UTC offset, by
+		  default TIMEZONES, which every SchoolLoop in the process shares
+		- limiter: RequestLimiter shared with other SchoolLoop objects to
+		  keep their requests to the server within its limits
+		- session_store: SessionStore to save the session in after every
+		  login, so resume() can pick it up next time
 		"""
 	
 		# schoolloop is so slow we can't waste time on unnecessary redirects
 		class LoginRedirectHandler (urllib2.HTTPRedirectHandler, object):
-			def __init__ (self):
-				super(LoginRedirectHandler, self).__init__()
-				self.enabled = False
-				self.mode = 0 # 0 = disabled, 1 = login, 2 = stop redirect
+			# the redirect policy travels on the request itself, so one handler
+			# can serve any number of concurrent requests
 			def redirect_request (self, *args):
-				if self.mode == 1:
+				mode = getattr(args[0], 'redirect', REDIRECT_FOLLOW)
+				if mode == REDIRECT_LOGIN:
 					if '/portal/login' in args[5]:
 						return urllib2.Request('lr:///fail')
 					else:
 						return urllib2.Request('lr:///success')
-				elif self.mode == 2:
+				elif mode == REDIRECT_STOP:
 					return urllib2.Request('lr:///%s' % urllib.quote (args[5]))
 				else:
 					return super(LoginRedirectHandler, self).redirect_request(*args)
@@ -50,16 +838,40 @@ class SchoolLoop(object):
 		
 		self.https = https
 		self.subdomain = subdomain
+		self.host = host or '%s.schoolloop.com' % subdomain
 		self.cache = {}
-		self.pages = {}
+		self.responseCache = response_cache
+		self.metrics = metrics
+		self.trustCharset = trust_charset
+		self.markupMassage = markup_massage
+		self.compactSoup = compact_soup
+		self.pages = page_cache
+		if self.pages is None:
+			self.pages = PageCache()
+		self.limiter = limiter
+		self.sessionStore = session_store
 		self.lrHandler = LoginRedirectHandler()
 		
 		self.cookiejar = cookiejar
 		if self.cookiejar is None:
 			self.cookiejar = PickleJar()
-		self.opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(self.cookiejar), self.lrHandler)
+		if pool is True:
+			pool = ConnectionPool()
+		self.pool = pool
+		handlers = [urllib2.HTTPCookieProcessor(self.cookiejar), self.lrHandler]
+		if self.pool is not None:
+			handlers.append(KeepAliveHandler(self.pool))
+		self.opener = urllib2.build_opener(*handlers)
 		
 		self.timezone = None
+		self.timezoneCache = timezone_cache
+		if self.timezoneCache is None:
+			self.timezoneCache = TIMEZONES
+		
+		self.credentials = credentials
+		self.user = None
+		self.loginLock = threading.RLock()
+		self.loginGeneration = 0
 			
 	def get_url (self, path):
 		"""
@@ -67,79 +879,176 @@ class SchoolLoop(object):
 		
 		- path: path to be converted to a URL
 		"""
-		return '%s://%s.schoolloop.com%s' % (self.https and 'https' or 'http', self.subdomain, path)
+		return '%s://%s%s' % (self.https and 'https' or 'http', self.host, path)
+	
+	def open (self, path, data=None, redirect=REDIRECT_FOLLOW, headers={}):
+		"""
+		Requests a path from Schoolloop. Returns the response, or a string if
+		the request was redirected and the redirect policy stopped it.
 		
-	def login (self, user, pswd):
+		- path: absolute path to request
+		- data: POST data, or None for a GET
+		- redirect: REDIRECT_FOLLOW, REDIRECT_LOGIN or REDIRECT_STOP
+		- headers: extra request headers
 		"""
-		Logs in to Schoolloop and establishes a session.
+		req = urllib2.Request(self.get_url(path), data, headers)
+		req.redirect = redirect
+		if self.limiter is None:
+			return self.opener.open(req)
+		with self.limiter:
+			return self.opener.open(req)
 		
-		- user: username
+	def login (self, user=None, pswd=None):
+		"""
+		Logs in to Schoolloop and establishes a session. The credentials are
+		kept so page() can log in again when the session expires.
+		
+		- user: username, defaults to the stored credentials
 		- pswd: password
 		"""
-		self.lrHandler.mode = 1
-		loginTry = self.opener.open(self.get_url('/portal/login?etarget=login_form'),
-			urllib.urlencode([('login_name', user), ('password', pswd),
-			('event.login.x', '0'), ('event.login.y', '0')]))
-		self.lrHandler.mode = 0
+		if user is None:
+			user, pswd = self.get_credentials()
+		with self.loginLock:
+			loginTry = self.open('/portal/login?etarget=login_form',
+				urllib.urlencode([('login_name', user), ('password', pswd),
+				('event.login.x', '0'), ('event.login.y', '0')]), REDIRECT_LOGIN)
+			if loginTry != "success":
+				return False
+			if not callable(self.credentials):
+				self.credentials = (user, pswd)
+			self.user = user
+			self.loginGeneration += 1
+			if self.sessionStore is not None:
+				self.sessionStore.save(self.subdomain, user, self.cookiejar)
+		return True
+	
+	def resume (self, user=None):
+		"""
+		Picks up the session of user saved in the session store, instead of
+		logging in. Nothing is sent to check it: if it has expired, the first
+		page fetched logs in again with the credentials. Returns False if no
+		session was saved.
+		
+		- user: username, defaults to the one in the stored credentials
+		"""
+		if user is None:
+			user = self.get_credentials()[0]
+		with self.loginLock:
+			if not resume_session(self, user):
+				return False
+			self.user = user
+			self.loginGeneration += 1
+		return True
+	
+	def get_credentials (self):
+		if callable(self.credentials):
+			return self.credentials()
+		if not self.credentials:
+			raise LoginError('not logged in and no credentials to log in with')
+		return self.credentials
+	
+	def relogin (self, generation=None):
+		"""
+		Logs in again with the stored credentials. When several threads find
+		the session expired at once, only the first one logs in.
 		
-		return loginTry == "success"
+		- generation: value of loginGeneration when the caller's request went out
+		"""
+		with self.loginLock:
+			if generation is not None and generation != self.loginGeneration:
+				return # someone else already logged in again
+			user, pswd = self.get_credentials()
+			calendarFilter = getattr(self.cookiejar, 'calendarSession', None) is not None
+			if not self.login(user, pswd):
+				raise LoginError('unable to log in again as %s' % user)
+			if calendarFilter and not self._set_calendar_filter():
+				# the new session starts with the default filter
+				raise LoginError('logged out again right after logging in')
 	
 	def login_status (self):
 		"""
 		Check if logged in.
 		"""
-		return bool(self.page('main', cache=False).soup)
+		return self.page('main', cache=False, relogin=False).raw is not None
 	
-	def page(self, page, params=None, cache=True):
+	def page(self, page, params=None, cache=True, relogin=True):
 		"""
 		Fetches a page from Schoolloop, caches it, and returns a SchoolLoopPage object.
+		If the session has expired, logs in again once and retries.
 		
 		- page: page keyword (see PAGE_TABLE)
 		- params: GET params
+		- relogin: set to False to return the logged out page instead
 		"""
+		start = self.metrics is not None and time.time()
 		key = (page, params)
-		if cache and key in self.pages: return self.pages[key]
-		self.pages[key] = SchoolLoopPage(self, PAGE_TABLE[page], params)
-		self.pages[key].load()
-		return self.pages[key]
+		if cache:
+			cached = self.pages.get(key)
+			if cached is not None:
+				if start: self.metrics(page_event(page, cached, start, 'hit'))
+				return cached
+		generation = self.loginGeneration
+		previous = self.pages.stale(key)
+		loaded = SchoolLoopPage(self, PAGE_TABLE[page], params)
+		loaded.load(previous)
+		if loaded.logged_out and relogin:
+			self.relogin(generation)
+			loaded = SchoolLoopPage(self, PAGE_TABLE[page], params)
+			loaded.load(previous)
+			if loaded.logged_out:
+				raise LoginError('logged out again right after logging in')
+			loaded.relogged = True
+		if loaded.redirect is None:
+			self.pages.put(key, loaded)
+		if start: self.metrics(page_event(page, loaded, start))
+		return loaded
+	
+	def fetch_many(self, pages, workers=4, cache=True):
+		"""
+		Fetches several pages at once on a pool of threads and returns the
+		SchoolLoopPage objects in the same order.
+		
+		- pages: list of page keywords or (page, params) tuples
+		- workers: maximum number of simultaneous requests
+		"""
+		keys = [isinstance(x, tuple) and x or (x, None) for x in pages]
+		unique = list(set(keys))
+		loaded = dict(zip(unique, threaded_map(lambda key: self.page(key[0], key[1], cache), unique, workers)))
+		return [loaded[key] for key in keys]
+	
+	def prefetch(self, pages=None, months=(), workers=4):
+		"""
+		Downloads pages in parallel ahead of time so the list methods are
+		served from the cache.
+		
+		- pages: list of page keywords, defaults to every page in PAGE_TABLE
+		- months: list of (month, year) tuples of calendar months to fetch
+		- workers: maximum number of simultaneous requests
+		"""
+		if pages is None:
+			pages = PAGE_TABLE.keys()
+		keys = list(pages)
+		if months or 'calendar' in keys:
+			self.show_all_events()
+		if months:
+			keys += [('calendar', self.month_params(month, year)) for month, year in months]
+		self.fetch_many(keys, workers)
 		
 	def class_list(self):
 		"""
 		Returns the list of classes as a list of tuples in the format
 		of (course_group_id, course_name, grade).
 		"""
-		classes = []
-		table = self.page('main').soup.find('tbody', { 'class' : 'hub_general_body' })
-		for row in table.findAll('tr'):
-			anchor = row.find('td', {'class': 'left'}).a
-			gradecell = [x for x in row.contents if type(x).__name__ == "Tag"][1]
-			if anchor and gradecell:
-				course_group_id = re.search(r'group_id=(\d+)', anchor['href']).group (1)
-				course_name = anchor.string
-				grade = ''
-				if gradecell['class'] == "list_text" and not gradecell.a:
-					grade = gradecell.contents[1]
-				if course_group_id and course_name:
-					classes.append ((course_group_id, course_name, grade))
-		return classes
+		loaded = self.page('main')
+		return loaded.extract(parse_classes, loaded.region('classes'))
 	
 	def dropbox_files(self):
 		"""
 		Returns the list of files in the dropbox as a list of tuples in the
 		format of (date, class, assignment_url, file_url).
 		"""
-		files = []
-		table = self.page('dropbox').soup.find('div', { 'id' : 'container_content' }).findAll('table')[1]
-		for el in table.findAll('tr')[1:]:
-			cells = el.findAll('td')
-			
-			date = cells[0].string
-			cls = cells[1].string
-			assignment = (cells[2].a['href'], cells[2].a.string)
-			file = (cells[3].a['href'], cells[3].a.string)
-			
-			files.append((date, cls, assignment, file))
-		return files
+		loaded = self.page('dropbox')
+		return loaded.extract(parse_dropbox_files, loaded.region('dropbox'))
 		
 	def assignment_list(self, class_filter=None):
 		"""
@@ -147,26 +1056,85 @@ class SchoolLoop(object):
 		
 		- class_filter: a class tuple (id, name) to filter the assignments by.
 		"""
-		assignments = []
-		table = self.page('main').soup.find(lambda tag: tag.string and tag.string.find('Current Assignments') != -1,
-		 									{ 'class' : 'title' }).nextSibling.tbody
-		assert table != None
-		for row in table.findAll('tr'):
-			cells = row.findAll('td')
-			cells.pop(2); cells.pop(4)
-
-			status = ''
-			if cells[0].img:
-				src = cells[0].img['src']
-				status = ('new.gif' in src and 'new') or ('due.gif' in src and 'due') or ''
-			
-			title = (cells[1].div.a['href'], cells[1].div.a.string)
-			cls = cells[2].div.string; cls = cls[:cls.rfind("Period") - 1]
-			date = datetime(*(time.strptime(cells[3].div.string, '%m/%d/%y')[0:6])).date()
-			
-			assignments.append((status, title, cls, date))
-		return assignments
+		loaded = self.page('main')
+		return loaded.extract(parse_assignments, loaded.soup)
+	
+	def iter_classes(self):
+		"""
+		Returns an iterator over the same tuples as class_list(), with plain
+		unicode strings. See SchoolLoopPage.iterate().
+		"""
+		return self.page('main').iterate(parse_classes, stream_classes, 'classes')
+	
+	def iter_dropbox_files(self):
+		"""
+		Returns an iterator over the same tuples as dropbox_files(), with
+		plain unicode strings. See SchoolLoopPage.iterate().
+		"""
+		return self.page('dropbox').iterate(parse_dropbox_files, stream_dropbox_files, 'dropbox')
+	
+	def iter_assignments(self):
+		"""
+		Returns an iterator over the same tuples as assignment_list(), with
+		plain unicode strings. See SchoolLoopPage.iterate().
+		"""
+		return self.page('main').iterate(parse_assignments, stream_assignments)
 			
+	def show_all_events(self, force=False):
+		"""
+		Sets the calendar filter to show every kind of event, unless it was
+		already set for this session. The cookie jar remembers which session
+		that was, so a pickled PickleJar brings it along.
+		
+		- force: set it anyway
+		"""
+		session = session_cookie(self.cookiejar)
+		if not force and session is not None and getattr(self.cookiejar, 'calendarSession', None) == session:
+			return
+		generation = self.loginGeneration
+		if self._set_calendar_filter():
+			return
+		# the session expired; relogin() sets the filter for the new one if
+		# it was set for the old one, otherwise it's set here, once
+		self.relogin(generation)
+		if getattr(self.cookiejar, 'calendarSession', None) != session_cookie(self.cookiejar) \
+				and not self._set_calendar_filter():
+			raise LoginError('logged out again right after logging in')
+	
+	def _set_calendar_filter(self):
+		# returns False if the session had expired
+		redirect = self.open('/calendar/setCalendarSettings', CALENDAR_SETTINGS, REDIRECT_STOP)
+		if isinstance(redirect, basestring) and '/portal/login' in redirect:
+			return False
+		self.cookiejar.calendarSession = session_cookie(self.cookiejar)
+		if self.sessionStore is not None and self.user is not None:
+			self.sessionStore.save(self.subdomain, self.user, self.cookiejar)
+		return True
+	
+	def month_params(self, month=None, year=None):
+		"""
+		Returns the GET params of the calendar page for a month, or None for
+		the current month.
+		
+		- month: Month of events
+		- year: Year of events
+		"""
+		if self.timezone is None:
+			self.timezone = self.timezoneCache.get(self.subdomain)
+		if self.timezone is None:
+			loaded = self.page('calendar')
+			self.timezone = loaded.extract(parse_timezone, loaded.soup)
+			self.timezoneCache.put(self.subdomain, self.timezone)
+		return calendar_params(self.timezone, month, year)
+	
+	def invalidate_timezone(self):
+		"""
+		Forgets the server's UTC offset, here and in the timezone cache, so
+		the next calendar call works it out again.
+		"""
+		self.timezone = None
+		self.timezoneCache.invalidate(self.subdomain)
+	
 	def calendar(self, month=None, year=None):
 		"""
 		Returns a list of events in the monthly calendar.
@@ -176,99 +1144,804 @@ class SchoolLoop(object):
 		- month: Month of events
 		- year: Year of events
 		"""
-		events = []
+		self.show_all_events()
 		
-		# show all events
-		if 'calendar' not in self.pages:
-			self.lrHandler.mode = 2
-			self.opener.open(self.get_url('/calendar/setCalendarSettings'),
-				'assigned=true&due=true&public=true&ugroups=true&uevents=true&x=0&y=0')
-			self.lrHandler.mode = 0
+		loaded = self.page('calendar', self.month_params(month, year))
+		return loaded.extract(parse_calendar, loaded.soup)
+	
+	def iter_events(self, month=None, year=None):
+		"""
+		Returns an iterator over the same tuples as calendar(), with plain
+		unicode strings. See SchoolLoopPage.iterate().
 		
-		# stupid time zones
-		if self.timezone is None:
-			dt = datetime.utcfromtimestamp((lambda x: sum(x) / len(x))(
-				[int(re.search('month_id=(\d+)', y['href']).group(1))
-				for y in self.page('calendar').soup.findAll(lambda x: x.name == "a" and
-				x.has_key('href') and re.search('month_id=[^0]', x['href']))]) / 1000)
-			
-			dst = False
-			if dt.month == 3:
-				# find the second sunday
-				sunday = datetime(dt.year, 3, 8)
-				while sunday.weekday () != 6:
-					sunday = sunday.replace (day = sunday.day + 1)
-				if dt.day > sunday.day:
-					dst = True
-			elif dt.month == 11:
-				# find the first sunday
-				sunday = datetime(dt.year, 11, 1)
-				while sunday.weekday () != 6:
-					sunday = sunday.replace (day = sunday.day + 1)
-				if dt.day <= sunday.day:
-					dst = True
-			elif dt.month > 3 and dt.month < 11:
-				dst = True
-			
-			self.timezone = -dt.hour
-			if dst: self.timezone -= 1
-		
-		month_id = None
-		if year or month:
-			hour = -self.timezone
-			if month > 3 and month <= 11: # DST
-				hour -= 1
-			month_id = calendar.timegm(datetime(year, month, 1, hour, 0, 0).timetuple()) * 1000
-		
-		soup = self.page('calendar', month_id and ('month_id=%d' % month_id) or None).soup
-		table = soup.find('table', {'class': 'cal_table'})
-		
-		day_id = int(re.search(r'day_id=(\d+)', table.findAll('td', {'class': 'cal_td'})[15].a['href']).group(1)) / 1000
-		dt = datetime.utcfromtimestamp(day_id)
-		year = dt.year
-		month = dt.month
-		
-		for td in table.findAll('td', {'class': 'cal_td'}):
-			dateSpan = td.find('span')
-			if (not dateSpan) or ('#888888' in dateSpan['style']):
-				continue
-			date = int(dateSpan.string)
-			
-			for div in td.findAll('div', style='font-size: 10px; font-weight: bold;'):
-				a = div.a
-				if not a: continue
-				
-				id = a['id']
-				desc = a.string
-			
-				course = None
-				if div.b:
-					course = div.b.string
-				
-				events.append((datedate(year, month, date), id, course, desc))
+		- month: Month of events
+		- year: Year of events
+		"""
+		self.show_all_events()
 		
-		return events
+		loaded = self.page('calendar', self.month_params(month, year))
+		return loaded.iterate(parse_calendar, stream_events)
+	
+	def calendar_range(self, start_date, end_date, workers=4):
+		"""
+		Returns the events from start_date to end_date, both included, in
+		the format of calendar(), sorted by date. The months are
+		downloaded in parallel.
+		
+		- start_date: first day, a date or datetime
+		- end_date: last day, a date or datetime
+		- workers: maximum number of simultaneous requests
+		"""
+		self.show_all_events()
+		
+		keys = [('calendar', self.month_params(month, year))
+			for month, year in calendar_months(start_date, end_date)]
+		pages = self.fetch_many(keys, workers)
+		return merge_events([loaded.extract(parse_calendar, loaded.soup) for loaded in pages],
+			start_date, end_date)
 		
 class SchoolLoopPage(object):
 	def __init__(self, loop, url, params):
 		self.loop = loop
 		self.url = url
-		self.soup = None
+		self.raw = None
+		self.charset = None
+		self.encoding = None
+		self._text = None
+		self._soup = None
+		self.regions = {}
+		self.redirect = None
+		self.size = 0
+		self.wire_size = 0
+		self.digest = None
+		self.revalidated = False
+		self.relogged = False
+		self.timings = {}
 		if params:
 			self.url += "?" + params
-	def load(self):
-		self.loop.lrHandler.mode = 2
-		pageHandle = self.loop.opener.open(self.loop.get_url(self.url))
-		self.loop.lrHandler.mode = 0
+	def load(self, previous=None):
+		"""
+		Downloads and parses the page.
+		
+		- previous: an older copy of this page; if the new one has the same
+		  content, its soup is reused instead of parsing again
+		"""
+		cache = self.loop.responseCache
+		if self.loop.user is None:
+			# entries are kept per user, and a client given only a cookiejar
+			# doesn't know whose session it has
+			cache = None
+		key = (self.loop.subdomain, self.loop.user, self.url)
+		entry = cache and cache.get(key)
+		headers = {'Accept-Encoding': ACCEPT_ENCODING}
+		if entry:
+			headers.update(cache.conditional_headers(entry))
+		
+		start = self.loop.metrics is not None and time.time()
+		try:
+			pageHandle = self.loop.open(self.url, redirect=REDIRECT_STOP, headers=headers)
+		except urllib2.HTTPError, err:
+			if err.code != 304 or not entry:
+				raise
+			if start: self.time_request(start, err.fp)
+			# finish the empty response so a pooled connection goes back to the pool
+			read_body(err)
+			err.close()
+			cache.stats['revalidated'] += 1
+			self.revalidated = True
+			self.charset = entry.get('charset')
+			return self.parse(entry['body'], previous)
 		
+		if start: start = self.time_request(start, pageHandle)
 		if isinstance (pageHandle, str):
+			self.redirect = pageHandle
 			return
 		
-		pageData = pageHandle.read()
+		pageData, self.wire_size = read_body(pageHandle)
+		if start: self.timings['download'] = time.time() - start
+		headers = pageHandle.info()
+		self.charset = headers.getparam('charset')
 		pageHandle.close()
 		del pageHandle
 		
-		self.soup = BeautifulSoup(pageData)
+		if cache:
+			cache.stats['misses'] += 1
+			cache.put(key, headers, pageData)
+		self.parse(pageData, previous)
+	def time_request(self, start, response):
+		# split the time until the headers arrived into connecting and waiting
+		now = time.time()
+		connect = getattr(response, 'connect_time', None)
+		self.timings['wait'] = now - start - (connect or 0)
+		if connect is not None:
+			self.timings['connect'] = connect
+		return now
+	logged_out = property(lambda self: bool(self.redirect and '/portal/login' in self.redirect))
+	def parse(self, pageData, previous=None):
+		"""
+		Takes in a downloaded page. Nothing is decoded or parsed until it is
+		asked for through text, soup or region(). size is the uncompressed
+		length of the page and wire_size what it took to download.
+		"""
+		self.raw = pageData
+		self.size = len(pageData)
+		self.digest = hashlib.sha1(pageData).hexdigest()
+		if previous is not None and previous.digest == self.digest:
+			# unchanged since last time, keep whatever was parsed already
+			self.encoding = previous.encoding
+			self._text = previous._text
+			self._soup = previous._soup
+			self.regions = previous.regions
+		return self
+	def getText(self):
+		"""
+		The page decoded to unicode, the same way BeautifulSoup would, trying
+		the charset the server sent first.
+		"""
+		if self._text is None and self.raw is not None:
+			start = self.loop.metrics is not None and time.time()
+			dammit = UnicodeDammit(self.raw, self.charset and [self.charset] or [],
+				smartQuotesTo=BeautifulSoup.HTML_ENTITIES, isHTML=True, sniff=not self.loop.trustCharset)
+			self._text = dammit.unicode
+			self.encoding = dammit.originalEncoding
+			if start:
+				self.loop.metrics({'event': 'decode', 'url': self.url, 'bytes': self.size,
+					'encoding': self.encoding, 'time': time.time() - start})
+		return self._text
+	text = property(getText)
+	def markup(self):
+		# decode once, then every tree is built from the same unicode
+		text = self.text
+		if text is None:
+			return self.raw
+		return text
+	def getSoup(self):
+		"""
+		The whole page as a tree, built the first time it's asked for.
+		"""
+		if self._soup is None and self.raw is not None:
+			self._soup = self.build(None)
+		return self._soup
+	def setSoup(self, soup):
+		self._soup = soup
+	soup = property(getSoup, setSoup)
+	def region(self, name):
+		"""
+		Returns a tree of just the part of the page named in REGIONS. This is
+		much cheaper than the whole page, which is used instead if it has
+		been built already.
+		
+		- name: key in REGIONS
+		"""
+		if self._soup is not None or self.raw is None:
+			return self._soup
+		if name not in self.regions:
+			self.regions[name] = self.build(name)
+		return self.regions[name]
+	def build(self, region):
+		markup = self.markup()
+		start = self.loop.metrics is not None and time.time()
+		if region is None:
+			soup = BeautifulSoup(markup, markupMassage=self.loop.markupMassage,
+				compact=self.loop.compactSoup)
+		else:
+			soup = BeautifulSoup(markup, parseOnlyThese=REGIONS[region], markupMassage=self.loop.markupMassage,
+				compact=self.loop.compactSoup)
+		if start:
+			self.loop.metrics({'event': 'parse', 'url': self.url, 'region': region,
+				'time': time.time() - start})
+		return soup
+	def extract(self, parser, soup):
+		"""
+		Runs one of the page parsers below over a tree from this page,
+		reporting how long it took to the loop's metrics.
+		
+		- parser: e.g. parse_classes
+		- soup: region() or soup of this page
+		"""
+		if self.loop.metrics is None:
+			return parser(soup)
+		start = time.time()
+		result = parser(soup)
+		self.loop.metrics({'event': 'extract', 'url': self.url, 'extractor': parser.__name__[len('parse_'):],
+			'items': isinstance(result, list) and len(result) or None, 'time': time.time() - start})
+		return result
+	def iterate(self, parser, streamer, region=None):
+		"""
+		Returns an iterator over what parser finds on this page, as plain
+		unicode. If the tree parser needs hasn't been built, the page is
+		run through streamer instead: rows are parsed as they are asked
+		for, no tree is kept, and parsing stops where the rows end.
+		
+		- parser: e.g. parse_classes
+		- streamer: the stream function that goes with it, e.g. stream_classes
+		- region: key in REGIONS that parser is given, None for the whole page
+		"""
+		if self.raw is None or self._soup is not None or region in self.regions:
+			soup = region is None and self.soup or self.region(region)
+			return (plain(row) for row in self.extract(parser, soup))
+		if self._text is None and self.loop.trustCharset and known_codec(self.charset):
+			# decoded as it's parsed, so the whole page is never decoded at once
+			return streamer(self.raw, self.charset, markup_massage=self.loop.markupMassage)
+		return streamer(self.markup(), markup_massage=self.loop.markupMassage)
+
+def known_codec(encoding):
+	"""
+	Checks that Python can decode encoding, e.g. a charset from a header.
+	"""
+	try:
+		return bool(encoding) and bool(codecs.lookup(encoding))
+	except LookupError:
+		return False
+
+def page_event(page, loaded, start, cache=None):
+	"""
+	Returns the metrics event for a page() call that started at start.
+	"""
+	event = {'event': 'page', 'page': page, 'url': loaded.url,
+		'cache': cache or (loaded.revalidated and 'revalidated' or 'miss'),
+		'redirect': loaded.redirect, 'relogin': cache is None and loaded.relogged, 'bytes': loaded.size,
+		'wire_bytes': 0, 'time': time.time() - start}
+	if cache is None:
+		event['wire_bytes'] = loaded.wire_size
+		event.update(loaded.timings)
+	return event
+
+class SessionPool(object):
+	"""
+	Keeps logged in SchoolLoop sessions for many accounts on one school,
+	keyed by username. A session logs in the first time it is asked for,
+	or resumes the saved one if there is a session_store.
+	Sessions share one ConnectionPool and RequestLimiter, plus anything
+	else passed for every session, like a ResponseCache (which keys pages
+	by user). Each has its own cookie jar and page cache.
+	
+	Sessions unused for idle_timeout seconds are dropped, as are the least
+	recently used ones beyond max_sessions. Past max_bytes of cached pages,
+	the least recently used sessions have their page caches cleared but
+	stay logged in; this is checked whenever a session is handed out. Safe
+	to use from several threads.
+	"""
+	def __init__(self, subdomain, credentials, max_sessions=None, idle_timeout=None, max_bytes=None,
+			max_requests=8, rate=None, pool=True, page_cache=PageCache, **kwargs):
+		"""
+		- subdomain: subdomain on Schoolloop website
+		- credentials: dict of username to password, or a function taking a
+		  username and returning the password
+		- max_sessions: most sessions kept, None for no limit
+		- idle_timeout: seconds an unused session is kept, None to keep it
+		- max_bytes: most page data cached over all sessions, None for no limit
+		- max_requests: most requests to the server at once over all sessions
+		- rate: most requests a second over all sessions, None for no limit
+		- pool: ConnectionPool for every session, True for a new one
+		- page_cache: function returning a new PageCache for each session
+		- kwargs: passed to every SchoolLoop, e.g. https, response_cache or
+		  session_store to resume sessions from an earlier run
+		"""
+		self.subdomain = subdomain
+		self.credentials = credentials
+		self.max_sessions = max_sessions
+		self.idle_timeout = idle_timeout
+		self.max_bytes = max_bytes
+		if pool is True:
+			pool = ConnectionPool(maxsize=max_requests or 4)
+		self.pool = pool
+		self.limiter = RequestLimiter(max_requests, rate)
+		self.page_cache = page_cache
+		self.kwargs = kwargs
+		self.lock = threading.Lock()
+		self.sessions = collections.OrderedDict() # user: (SchoolLoop, last used)
+		self.stats = {'logins': 0, 'evictions': 0, 'expirations': 0, 'cleared': 0}
+
+	def password(self, user):
+		if callable(self.credentials):
+			return self.credentials(user)
+		return self.credentials[user]
+
+	def create(self, user):
+		"""
+		Returns a new, logged out SchoolLoop for user.
+		"""
+		return SchoolLoop(self.subdomain, pool=self.pool, limiter=self.limiter,
+			credentials=lambda: (user, self.password(user)), page_cache=self.page_cache(), **self.kwargs)
+
+	def get(self, user):
+		"""
+		Returns the logged in session of user, logging in if needed.
+		Raises LoginError if that fails.
+		"""
+		with self.lock:
+			self.expire()
+			entry = self.sessions.pop(user, None)
+			session = entry and entry[0] or self.create(user)
+			self.sessions[user] = (session, time.time())
+			while self.max_sessions is not None and len(self.sessions) > self.max_sessions:
+				self.sessions.popitem(last=False)
+				self.stats['evictions'] += 1
+		with session.loginLock:
+			if session.user is None and not (session.sessionStore and session.resume(user)):
+				if not session.login():
+					raise LoginError('unable to log in as %s' % user)
+				with self.lock:
+					self.stats['logins'] += 1
+		self.trim()
+		return session
+
+	def map(self, func, users, workers=8):
+		"""
+		Calls func with the session of each user on up to `workers` threads
+		at once and returns the results in the same order, see threaded_map().
+		"""
+		return threaded_map(lambda user: func(self.get(user)), users, workers)
+
+	def expire(self):
+		# with the lock held
+		if self.idle_timeout is None:
+			return
+		cutoff = time.time() - self.idle_timeout
+		while self.sessions:
+			user, (session, used) = next(self.sessions.iteritems())
+			if used >= cutoff:
+				break
+			del self.sessions[user]
+			self.stats['expirations'] += 1
+
+	def trim(self):
+		"""
+		Clears the page caches of the least recently used sessions until the
+		pages cached by all of them fit in max_bytes.
+		"""
+		if self.max_bytes is None:
+			return
+		with self.lock:
+			sessions = [session for session, used in self.sessions.itervalues()]
+		total = sum(session.pages.bytes for session in sessions)
+		for session in sessions[:-1]:
+			if total <= self.max_bytes:
+				break
+			if session.pages.bytes:
+				total -= session.pages.bytes
+				session.pages.clear()
+				self.stats['cleared'] += 1
+
+	def evict(self, user=None):
+		"""
+		Drops the session of user, or every session.
+		"""
+		with self.lock:
+			if user is None:
+				self.sessions.clear()
+			else:
+				self.sessions.pop(user, None)
+
+	def __contains__(self, user):
+		with self.lock:
+			return user in self.sessions
+
+	def __len__(self):
+		return len(self.sessions)
+
+# Page parsers. These only look at a parsed page, so SchoolLoop and
+# AsyncSchoolLoop share them.
+
+def parse_classes(soup):
+	"""
+	Extracts (course_group_id, course_name, grade) tuples from the main page.
+	"""
+	classes = []
+	table = soup.find(QUERIES['classes'])
+	for row in table.findAll('tr'):
+		cls = parse_class_row(row)
+		if cls:
+			classes.append (cls)
+	return classes
+
+def parse_class_row(row):
+	"""
+	Extracts the (course_group_id, course_name, grade) tuple of one row of
+	the class list, or None.
+	"""
+	anchor = row.find(QUERIES['class_link']).a
+	gradecell = [x for x in row.contents if type(x).__name__ == "Tag"][1]
+	if anchor and gradecell:
+		course_group_id = re.search(r'group_id=(\d+)', anchor['href']).group (1)
+		course_name = anchor.string
+		grade = ''
+		if gradecell['class'] == "list_text" and not gradecell.a:
+			grade = gradecell.contents[1]
+		if course_group_id and course_name:
+			return (course_group_id, course_name, grade)
+	return None
+
+def parse_dropbox_files(soup):
+	"""
+	Extracts (date, class, assignment_url, file_url) tuples from the dropbox page.
+	"""
+	table = soup.find(QUERIES['dropbox']).findAll('table')[1]
+	return [parse_dropbox_row(el) for el in table.findAll('tr')[1:]]
+
+def parse_dropbox_row(el):
+	"""
+	Extracts the (date, class, assignment_url, file_url) tuple of one row of
+	the dropbox.
+	"""
+	cells = el.findAll('td')
+	
+	date = cells[0].string
+	cls = cells[1].string
+	assignment = (cells[2].a['href'], cells[2].a.string)
+	file = (cells[3].a['href'], cells[3].a.string)
+	
+	return (date, cls, assignment, file)
+
+def parse_assignments(soup):
+	"""
+	Extracts (state, title, class, due) tuples from the main page.
+	"""
+	table = soup.find(QUERIES['assignments']).nextSibling.tbody
+	assert table != None
+	return [parse_assignment_row(row) for row in table.findAll('tr')]
+
+def parse_assignment_row(row):
+	"""
+	Extracts the (state, title, class, due) tuple of one row of the
+	assignment list.
+	"""
+	cells = row.findAll('td')
+	cells.pop(2); cells.pop(4)
+
+	status = ''
+	if cells[0].img:
+		src = cells[0].img['src']
+		status = ('new.gif' in src and 'new') or ('due.gif' in src and 'due') or ''
+	
+	title = (cells[1].div.a['href'], cells[1].div.a.string)
+	cls = cells[2].div.string; cls = cls[:cls.rfind("Period") - 1]
+	date = datetime(*(time.strptime(cells[3].div.string, '%m/%d/%y')[0:6])).date()
+	
+	return (status, title, cls, date)
+
+def parse_timezone(soup):
+	"""
+	Works out the server's UTC offset (in hours, standard time) from the
+	month_id links on a calendar page.
+	"""
+	# stupid time zones
+	dt = datetime.utcfromtimestamp((lambda x: sum(x) / len(x))(
+		[int(re.search('month_id=(\d+)', y['href']).group(1))
+		for y in soup.findAll(QUERIES['month_links'])]) / 1000)
+	
+	dst = False
+	if dt.month == 3:
+		# find the second sunday
+		sunday = datetime(dt.year, 3, 8)
+		while sunday.weekday () != 6:
+			sunday = sunday.replace (day = sunday.day + 1)
+		if dt.day > sunday.day:
+			dst = True
+	elif dt.month == 11:
+		# find the first sunday
+		sunday = datetime(dt.year, 11, 1)
+		while sunday.weekday () != 6:
+			sunday = sunday.replace (day = sunday.day + 1)
+		if dt.day <= sunday.day:
+			dst = True
+	elif dt.month > 3 and dt.month < 11:
+		dst = True
+	
+	timezone = -dt.hour
+	if dst: timezone -= 1
+	return timezone
+
+def calendar_params(timezone, month=None, year=None):
+	"""
+	Returns the GET params of the calendar page for a month, or None for
+	the current month.
+	"""
+	month_id = None
+	if year or month:
+		hour = -timezone
+		if month > 3 and month <= 11: # DST
+			hour -= 1
+		month_id = calendar.timegm(datetime(year, month, 1, hour, 0, 0).timetuple()) * 1000
+	
+	return month_id and ('month_id=%d' % month_id) or None
+
+def calendar_months(start_date, end_date):
+	"""
+	Returns the (month, year) tuples of every month from start_date to
+	end_date.
+	"""
+	months = []
+	month, year = start_date.month, start_date.year
+	while (year, month) <= (end_date.year, end_date.month):
+		months.append((month, year))
+		month += 1
+		if month > 12:
+			month, year = 1, year + 1
+	return months
+
+def merge_events(months, start_date, end_date):
+	"""
+	Merges the events of several calendar pages into one list sorted by
+	date, keeping those from start_date to end_date and dropping any that
+	more than one page showed.
+	"""
+	if isinstance(start_date, datetime): start_date = start_date.date()
+	if isinstance(end_date, datetime): end_date = end_date.date()
+	
+	events = []
+	seen = set()
+	for event in (event for month in months for event in month):
+		if not start_date <= event[0] <= end_date or event[:2] in seen:
+			continue
+		seen.add(event[:2])
+		events.append(event)
+	events.sort(key=lambda event: event[0])
+	return events
+
+def parse_calendar(soup):
+	"""
+	Extracts (date, id, course, description) tuples from a calendar page.
+	"""
+	events = []
+	table = soup.find(QUERIES['calendar'])
+	days = table.findAll(QUERIES['calendar_day'])
+	year, month = calendar_month(days)
+	
+	for td in days:
+		events.extend(parse_calendar_day(td, year, month))
+	
+	return events
+
+def calendar_month(days):
+	"""
+	Returns the (year, month) a calendar page shows, given its day cells.
+	The first few cells can be the end of the month before.
+	"""
+	day_id = int(re.search(r'day_id=(\d+)', days[15].a['href']).group(1)) / 1000
+	dt = datetime.utcfromtimestamp(day_id)
+	return dt.year, dt.month
+
+def parse_calendar_day(td, year, month):
+	"""
+	Extracts the (date, id, course, description) tuples of one day cell of a
+	calendar page.
+	"""
+	events = []
+	dateSpan = td.find('span')
+	if (not dateSpan) or ('#888888' in dateSpan['style']):
+		return events
+	date = int(dateSpan.string)
+	
+	for div in td.findAll(QUERIES['calendar_event']):
+		a = div.a
+		if not a: continue
+		
+		id = a['id']
+		desc = a.string
+	
+		course = None
+		if div.b:
+			course = div.b.string
+		
+		events.append((datedate(year, month, date), id, course, desc))
+	
+	return events
+
+# Streaming page parsers. These run a page through a SoupStream instead of
+# building its tree, keep one row at a time and parse it with the same row
+# parsers as above, so they find the same things. Their strings are plain
+# unicode, so nothing holds on to a row once it's parsed.
+
+def plain(value):
+	"""
+	Returns value, or the tuple value, with NavigableStrings turned into
+	unicode.
+	"""
+	if isinstance(value, NavigableString):
+		return unicode(value)
+	if isinstance(value, tuple):
+		return tuple(plain(x) for x in value)
+	return value
+
+class StreamHandler(object):
+	"""
+	SoupStream handler that keeps the rows of one table of a page and
+	collects what parse_row() makes of them in results. Subclasses say
+	where the table is by setting self.table in start(). The rest of the
+	page is skipped once the table ends.
+	
+	- what: what the table holds, for the error when a page doesn't have it
+	"""
+	what = 'table'
+	
+	def __init__(self):
+		self.results = collections.deque()
+		self.table = None # the table, while it's open
+		self.found = False
+		self.row = None
+	def start(self, tag):
+		if self.table is not None and self.row is None and self.is_row(tag):
+			self.row = tag
+			return True
+		return False
+	def end(self, tag):
+		if tag is self.row:
+			self.row = None
+			self.add_row(tag)
+		elif tag is self.table:
+			self.table = None
+			raise StopParsing
+	def is_row(self, tag):
+		return tag.name == 'tr'
+	def add_row(self, row):
+		result = self.parse_row(row)
+		if result is not None:
+			self.results.append(plain(result))
+	def close(self):
+		"""
+		Called at the end of the page.
+		"""
+		if not self.found:
+			raise SchoolLoopError('no %s on the page' % self.what)
+
+class ClassesHandler(StreamHandler):
+	what = 'class list'
+	parse_row = staticmethod(parse_class_row)
+	
+	def start(self, tag):
+		if not self.found and QUERIES['classes'].search(tag):
+			self.table = tag
+			self.found = True
+		return super(ClassesHandler, self).start(tag)
+
+class DropboxHandler(StreamHandler):
+	what = 'dropbox'
+	parse_row = staticmethod(parse_dropbox_row)
+	
+	def __init__(self):
+		super(DropboxHandler, self).__init__()
+		self.content = None # the content div, while it's open
+		self.tables = None # tables seen in it
+		self.rows = 0
+	def start(self, tag):
+		if self.content is not None and not self.found and tag.name == 'table':
+			# the second table in the content div
+			self.tables += 1
+			if self.tables == 2:
+				self.table = tag
+				self.found = True
+		elif self.tables is None and QUERIES['dropbox'].search(tag):
+			self.content = tag
+			self.tables = 0
+		return super(DropboxHandler, self).start(tag)
+	def end(self, tag):
+		if tag is self.content:
+			self.content = None
+		super(DropboxHandler, self).end(tag)
+	def is_row(self, tag):
+		# the first row holds the headings
+		if tag.name == 'tr':
+			self.rows += 1
+			return self.rows > 1
+		return False
+
+class AssignmentsHandler(StreamHandler):
+	what = 'assignment list'
+	parse_row = staticmethod(parse_assignment_row)
+	
+	def __init__(self):
+		super(AssignmentsHandler, self).__init__()
+		self.title = None # a tag that might be the list's title, while it's open
+		self.titleParent = None # the title's parent, once it's found
+		self.listTable = None
+	def start(self, tag):
+		if self.titleParent is None:
+			if self.title is None and tag.get('class') == 'title':
+				self.title = tag
+				return True
+		elif self.listTable is None:
+			# the table right after the title
+			if tag.parent is self.titleParent:
+				self.listTable = tag
+		elif not self.found and tag.name == 'tbody':
+			parent = tag.parent
+			while parent is not None and parent is not self.listTable:
+				parent = parent.parent
+			if parent is not None:
+				self.table = tag
+				self.found = True
+		return super(AssignmentsHandler, self).start(tag)
+	def end(self, tag):
+		if self.title is not None and self.titleParent is None and QUERIES['assignments'].search(tag):
+			self.titleParent = tag.parent
+		if tag is self.title:
+			self.title = None
+		super(AssignmentsHandler, self).end(tag)
+
+class CalendarHandler(StreamHandler):
+	what = 'calendar'
+	
+	def __init__(self):
+		super(CalendarHandler, self).__init__()
+		self.days = [] # the first day cells, until the month is known
+		self.month = None
+	def start(self, tag):
+		if not self.found and QUERIES['calendar'].search(tag):
+			self.table = tag
+			self.found = True
+		return super(CalendarHandler, self).start(tag)
+	def is_row(self, tag):
+		return QUERIES['calendar_day'].search(tag) is not None
+	def add_row(self, td):
+		if self.month is None:
+			self.days.append(td)
+			if len(self.days) < 16:
+				return
+			self.month = calendar_month(self.days)
+			days, self.days = self.days, None
+		else:
+			days = [td]
+		for td in days:
+			self.results.extend(plain(event) for event in parse_calendar_day(td, *self.month))
+	def close(self):
+		super(CalendarHandler, self).close()
+		if self.month is None:
+			calendar_month(self.days) # raises, as parse_calendar would
+
+def stream(handler, markup, encoding=None, markup_massage=BeautifulSoup.COMBINED_MARKUP_MASSAGE,
+		chunk_size=16384):
+	"""
+	Runs a page through a SoupStream, yielding what the handler finds as
+	soon as it finds it.
+	
+	- handler: StreamHandler for the page
+	- markup: the page as a string, or an iterable of strings such as a file
+	- encoding: the encoding of markup, if it isn't Unicode
+	- markup_massage: markupMassage for the stream, see SchoolLoop
+	"""
+	parser = SoupStream(handler, markupMassage=markup_massage, fromEncoding=encoding)
+	chunks = markup
+	if isinstance(markup, basestring):
+		chunks = (markup[i:i + chunk_size] for i in xrange(0, len(markup), chunk_size))
+	for chunk in chunks:
+		parser.feed(chunk)
+		while handler.results:
+			yield handler.results.popleft()
+	parser.close()
+	handler.close()
+	while handler.results:
+		yield handler.results.popleft()
+
+def stream_classes(markup, encoding=None, **kwargs):
+	"""
+	Yields the (course_group_id, course_name, grade) tuples parse_classes()
+	finds on the main page, without parsing the whole page. See stream().
+	"""
+	return stream(ClassesHandler(), markup, encoding, **kwargs)
+
+def stream_assignments(markup, encoding=None, **kwargs):
+	"""
+	Yields the (state, title, class, due) tuples parse_assignments() finds
+	on the main page, without parsing the whole page. See stream().
+	"""
+	return stream(AssignmentsHandler(), markup, encoding, **kwargs)
+
+def stream_dropbox_files(markup, encoding=None, **kwargs):
+	"""
+	Yields the (date, class, assignment_url, file_url) tuples
+	parse_dropbox_files() finds on the dropbox page, without parsing the
+	whole page. See stream().
+	"""
+	return stream(DropboxHandler(), markup, encoding, **kwargs)
+
+def stream_events(markup, encoding=None, **kwargs):
+	"""
+	Yields the (date, id, course, description) tuples parse_calendar() finds
+	on a calendar page, without parsing the whole page. See stream().
+	"""
+	return stream(CalendarHandler(), markup, encoding, **kwargs)
 
 def main(args):
 	from optparse import OptionParser
@@ -306,14 +1979,20 @@ def main(args):
 		dest="assignments",
 		default=False,
 		help="Print list of assignments.")
+	parser.add_option("-s", "--sessions",
+		action="store",
+		dest="sessions",
+		default=None,
+		help="Directory to keep the session in between runs, so logging in is only needed when it expires.")
 	(options, args) = parser.parse_args(args)
 
 	username, password = options.username, options.password
 	if not username: username = raw_input("Username: ")
 	if not password: password = getpass("Password: ")
 	
-	s = SchoolLoop('lhs-sfusd-ca')
-	if not s.login(username, password):
+	s = SchoolLoop('lhs-sfusd-ca', credentials=(username, password),
+		session_store=options.sessions and SessionStore(options.sessions))
+	if not s.resume(username) and not s.login(username, password):
 		print "error: unable to login"
 		sys.exit()
 	
@@ -0,0 +1,813 @@
+#!/usr/bin/python
+"""
+Non-blocking variant of SchoolLoop, for running many sessions from one
+process without a thread per request.
+
+There is no asyncio in Python 2, so this runs generator based coroutines on
+top of asyncore. A coroutine is a generator that yields what it is waiting
+for (a Future, another coroutine, or a list of either) and gets the result
+sent back. It returns a value by raising Return(value).
+
+	loop = EventLoop()
+	def sync(s, user, pswd):
+		if (yield s.login(user, pswd)):
+			classes, events = yield [s.class_list(), s.calendar()]
+			raise Return((classes, events))
+	results = loop.run([sync(AsyncSchoolLoop('lhs-sfusd-ca', loop), u, p)
+		for u, p in accounts])
+"""
+
+import asyncore, socket, ssl, errno, collections, threading, Queue, types
+import urllib, urllib2, urlparse, httplib, time, sys, os
+from cStringIO import StringIO
+from BeautifulSoup import BeautifulSoup
+
+from schoolloop import PAGE_TABLE, CALENDAR_SETTINGS, ACCEPT_ENCODING, REDIRECT_FOLLOW, REDIRECT_LOGIN, \
+	REDIRECT_STOP, PickleJar, PageCache, TIMEZONES, LoginError, session_cookie, resume_session, SchoolLoopPage, page_event, read_body, parse_classes, parse_dropbox_files, \
+	parse_assignments, parse_timezone, calendar_params, parse_calendar, calendar_months, merge_events, stream_classes, stream_dropbox_files, \
+	stream_assignments, stream_events
+
+MAX_REDIRECTS = 10
+
+class Return(Exception):
+	"""
+	Raised by a coroutine to return a value.
+	"""
+	def __init__(self, value=None):
+		Exception.__init__(self)
+		self.value = value
+
+class Future(object):
+	"""
+	The result of an operation that may not have finished yet.
+	"""
+	def __init__(self):
+		self.done = False
+		self.value = None
+		self.exc_info = None
+		self.callbacks = []
+	def set_result(self, value):
+		self.value = value
+		self._finish()
+	def set_exception(self, exc_info):
+		self.exc_info = exc_info
+		self._finish()
+	def _finish(self):
+		self.done = True
+		callbacks, self.callbacks = self.callbacks, []
+		for callback in callbacks:
+			callback(self)
+	def add_done_callback(self, callback):
+		if self.done:
+			callback(self)
+		else:
+			self.callbacks.append(callback)
+	def result(self):
+		if self.exc_info:
+			raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+		return self.value
+
+class Task(Future):
+	"""
+	Runs a coroutine on an EventLoop, finishing with its return value.
+	"""
+	def __init__(self, loop, coro):
+		Future.__init__(self)
+		self.loop = loop
+		self.coro = coro
+		loop.call_soon(self.step, None, None)
+	def step(self, value, exc_info):
+		try:
+			if exc_info:
+				waiting = self.coro.throw(*exc_info)
+			else:
+				waiting = self.coro.send(value)
+		except Return, ret:
+			self.set_result(ret.value)
+		except StopIteration:
+			self.set_result(None)
+		except Exception:
+			self.set_exception(sys.exc_info())
+		else:
+			self.loop.wait(waiting).add_done_callback(self.wakeup)
+	def wakeup(self, future):
+		# always resume from the loop, never from inside another callback
+		self.loop.call_soon(self.step, future.value, future.exc_info)
+
+class Waker(asyncore.file_dispatcher):
+	"""
+	Pipe that lets executor threads interrupt the loop's poll().
+	"""
+	def __init__(self, map):
+		self.reader, self.writer = os.pipe()
+		asyncore.file_dispatcher.__init__(self, self.reader, map)
+	def wake(self):
+		os.write(self.writer, 'x')
+	def writable(self):
+		return False
+	def handle_read(self):
+		self.recv(4096)
+
+class EventLoop(object):
+	"""
+	Runs coroutines and the sockets they wait on. One loop can serve any
+	number of AsyncSchoolLoop sessions.
+	"""
+	def __init__(self, workers=2, ssl_context=None):
+		"""
+		- workers: number of threads for run_in_executor()
+		- ssl_context: ssl.SSLContext for https, defaults to the system defaults
+		"""
+		self.map = {}
+		self.ready = collections.deque()
+		self.workers = workers
+		self.jobs = None
+		self.finished = collections.deque()
+		self.waker = None
+		self.addresses = {}
+		self.ssl_context = ssl_context or ssl.create_default_context()
+		self.last_timeout_check = 0
+
+	def call_soon(self, func, *args):
+		self.ready.append((func, args))
+
+	def spawn(self, coro):
+		"""
+		Starts a coroutine and returns its Task.
+		"""
+		return Task(self, coro)
+
+	def wait(self, waiting):
+		"""
+		Returns a Future for whatever a coroutine yielded.
+		"""
+		if isinstance(waiting, Future):
+			return waiting
+		elif isinstance(waiting, types.GeneratorType):
+			return Task(self, waiting)
+		elif isinstance(waiting, (list, tuple)):
+			return self.gather(waiting)
+		raise TypeError('coroutine yielded %r' % (waiting,))
+
+	def gather(self, waiting):
+		"""
+		Returns a Future for the list of results of several coroutines or
+		futures. It fails with the first exception, in list order.
+		"""
+		futures = [self.wait(x) for x in waiting]
+		gathered = Future()
+		pending = [len(futures)]
+		def done(future):
+			pending[0] -= 1
+			if pending[0]:
+				return
+			for future in futures:
+				if future.exc_info:
+					gathered.set_exception(future.exc_info)
+					return
+			gathered.set_result([future.value for future in futures])
+		if not futures:
+			gathered.set_result([])
+		for future in futures:
+			future.add_done_callback(done)
+		return gathered
+
+	def run_in_executor(self, func, *args):
+		"""
+		Calls func on a worker thread and returns a Future for its result.
+		"""
+		if self.jobs is None:
+			self.jobs = Queue.Queue()
+			self.waker = Waker(self.map)
+			for i in range(self.workers):
+				thread = threading.Thread(target=self._worker)
+				thread.daemon = True
+				thread.start()
+		future = Future()
+		self.jobs.put((future, func, args))
+		return future
+
+	def _worker(self):
+		while True:
+			future, func, args = self.jobs.get()
+			try:
+				self.finished.append((future, func(*args), None))
+			except Exception:
+				self.finished.append((future, None, sys.exc_info()))
+			self.waker.wake()
+
+	def run(self, coro):
+		"""
+		Runs a coroutine (or list of them) until it finishes and returns
+		its result.
+		"""
+		future = self.wait(coro)
+		while not future.done:
+			self.run_once()
+		return future.result()
+
+	def run_once(self, timeout=1.0):
+		while self.finished:
+			future, value, exc_info = self.finished.popleft()
+			if exc_info:
+				future.set_exception(exc_info)
+			else:
+				future.set_result(value)
+
+		ready, self.ready = self.ready, collections.deque()
+		for func, args in ready:
+			func(*args)
+
+		now = time.time()
+		if now - self.last_timeout_check >= 1:
+			self.last_timeout_check = now
+			for channel in self.map.values():
+				if isinstance(channel, HTTPConnection) and channel.deadline < now:
+					channel.fail((socket.timeout, socket.timeout('timed out'), None))
+
+		if self.ready or self.finished:
+			timeout = 0
+		if self.map:
+			asyncore.loop(timeout, True, self.map, 1)
+		elif not self.ready and not self.finished:
+			raise RuntimeError('nothing left to run, but coroutines are still waiting')
+
+	def resolve(self, host, port):
+		"""
+		Coroutine. Looks up an address, off the loop, caching the answer.
+		"""
+		key = (host, port)
+		if key not in self.addresses:
+			infos = yield self.run_in_executor(socket.getaddrinfo, host, port, 0, socket.SOCK_STREAM)
+			self.addresses[key] = infos[0]
+		raise Return(self.addresses[key])
+
+	def fetch(self, req, timeout=60):
+		"""
+		Coroutine. Sends a urllib2.Request and returns the response without
+		following redirects. Responses are urllib.addinfourl objects, so
+		cookielib can read them.
+		"""
+		host, port = urllib.splitport(req.get_host())
+		https = req.get_type() == 'https'
+		port = int(port or (https and 443 or 80))
+		family, socktype, proto, canonname, address = yield self.resolve(host, port)
+
+		headers = dict((name.title(), value) for name, value in req.header_items())
+		headers.setdefault('Host', req.get_host())
+		headers.setdefault('User-Agent', 'Python-urllib/%s' % urllib2.__version__)
+		headers['Connection'] = 'close'
+		if req.has_data():
+			headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+			headers['Content-Length'] = str(len(req.get_data()))
+		request = ['%s %s HTTP/1.1' % (req.get_method(), req.get_selector())]
+		request += ['%s: %s' % item for item in headers.items()]
+		request = '\r\n'.join(request) + '\r\n\r\n' + (req.get_data() or '')
+
+		future = Future()
+		HTTPConnection(self, family, address, https and host, request, future, timeout)
+		status, reason, message, body = yield future
+		response = urllib.addinfourl(StringIO(body), message, req.get_full_url())
+		response.code = status
+		response.msg = reason
+		raise Return(response)
+
+class HTTPConnection(asyncore.dispatcher):
+	"""
+	Sends one request on its own connection and completes `future` with
+	(status, reason, headers, body) when the response is in.
+	"""
+	def __init__(self, loop, family, address, tls_host, request, future, timeout):
+		asyncore.dispatcher.__init__(self, map=loop.map)
+		self.loop = loop
+		self.tls_host = tls_host
+		self.outbuf = request
+		self.inbuf = []
+		self.received = 0
+		self.head = None
+		self.length = None
+		self.future = future
+		self.handshaking = False
+		self.want_write = False
+		self.deadline = time.time() + timeout
+		self.create_socket(family, socket.SOCK_STREAM)
+		try:
+			self.connect(address)
+		except socket.error:
+			self.fail(sys.exc_info())
+
+	def readable(self):
+		return True
+
+	def writable(self):
+		if not self.connected:
+			return True
+		if self.handshaking:
+			return self.want_write
+		return bool(self.outbuf)
+
+	def handle_connect(self):
+		if self.tls_host:
+			sock = self.loop.ssl_context.wrap_socket(self.socket,
+				server_hostname=self.tls_host, do_handshake_on_connect=False)
+			self.del_channel()
+			self.set_socket(sock)
+			self.handshaking = True
+			self.handshake()
+
+	def handshake(self):
+		try:
+			self.socket.do_handshake()
+		except ssl.SSLWantReadError:
+			self.want_write = False
+		except ssl.SSLWantWriteError:
+			self.want_write = True
+		else:
+			self.handshaking = False
+
+	def handle_write(self):
+		if self.handshaking:
+			return self.handshake()
+		try:
+			sent = self.socket.send(self.outbuf)
+		except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+			return
+		except socket.error, err:
+			if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+				return
+			raise
+		self.outbuf = self.outbuf[sent:]
+
+	def handle_read(self, drain=False):
+		if self.handshaking:
+			return self.handshake()
+		while self.socket:
+			try:
+				data = self.socket.recv(65536)
+			except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+				return
+			except socket.error, err:
+				if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+					return
+				raise
+			if not data:
+				return self.finish()
+			self.inbuf.append(data)
+			self.received += len(data)
+			if self.complete():
+				return self.finish()
+			# plain sockets will poll readable again, TLS ones may be
+			# holding decrypted data that poll() can't see
+			if not self.tls_host and not drain:
+				return
+
+	def complete(self):
+		if self.head is None:
+			data = ''.join(self.inbuf)
+			end = data.find('\r\n\r\n')
+			if end == -1:
+				self.inbuf = [data]
+				return False
+			self.head = data[:end]
+			self.inbuf = [data[end + 4:]]
+			self.received = len(self.inbuf[0])
+			status = int(self.head.split(None, 2)[1])
+			lines = self.head.lower().split('\r\n')
+			if status in (204, 304) or 100 <= status < 200:
+				self.length = 0
+			elif 'transfer-encoding: chunked' not in lines:
+				for line in lines:
+					if line.startswith('content-length:'):
+						self.length = int(line[15:])
+		return self.length is not None and self.received >= self.length
+
+	def handle_close(self):
+		# pick up whatever arrived before the hangup
+		if self.connected and not self.handshaking:
+			self.handle_read(drain=True)
+		self.finish()
+
+	def handle_error(self):
+		self.fail(sys.exc_info())
+
+	def finish(self):
+		self.close()
+		if self.future.done:
+			return
+		if self.head is None and not self.complete():
+			return self.future.set_exception((httplib.BadStatusLine, httplib.BadStatusLine(''), None))
+		status_line, _, header_text = self.head.partition('\r\n')
+		version, status, reason = (status_line.split(None, 2) + [''])[:3]
+		message = httplib.HTTPMessage(StringIO(header_text + '\r\n\r\n'))
+		body = ''.join(self.inbuf)
+		if message.get('transfer-encoding', '').lower() == 'chunked':
+			body = dechunk(body)
+		elif self.length is not None:
+			body = body[:self.length]
+		self.future.set_result((int(status), reason.strip(), message, body))
+
+	def fail(self, exc_info):
+		self.close()
+		if not self.future.done:
+			self.future.set_exception(exc_info)
+
+def dechunk(data):
+	"""
+	Decodes a chunked transfer-encoded body.
+	"""
+	chunks = []
+	pos = 0
+	while True:
+		end = data.find('\r\n', pos)
+		if end == -1:
+			break
+		size = int(data[pos:end].split(';')[0], 16)
+		if not size:
+			break
+		chunks.append(data[end + 2:end + 2 + size])
+		pos = end + 2 + size + 2
+	return ''.join(chunks)
+
+class AsyncSchoolLoop(object):
+	"""
+	SchoolLoop session whose methods are coroutines, see the module docs.
+	Pages are parsed by the same code as SchoolLoop.
+	"""
+	def __init__(self, subdomain, eventloop, https=True, cookiejar=None,
+			credentials=None, page_cache=None, parse_in_executor=False, timeout=60, host=None,
+			metrics=None, trust_charset=True, markup_massage=BeautifulSoup.COMBINED_MARKUP_MASSAGE,
+			compact_soup=False, timezone_cache=None, session_store=None):
+		"""
+		- subdomain: subdomain on Schoolloop website (https://<subdomain>.schoolloop.com/)
+		- eventloop: EventLoop this session runs on
+		- https: set to False to disable https
+		- cookiejar: cookiejar from previous session to speed up login
+		- credentials: (username, password), or a function returning them, used
+		  to log in again when the session expires. login() sets this too.
+		- page_cache: PageCache for downloaded pages
+		- parse_in_executor: build the soup of each page on one of the event
+		  loop's worker threads instead of on the loop itself
+		- timeout: seconds before a request is given up on
+		- host: host[:port] to talk to instead of <subdomain>.schoolloop.com
+		- metrics: function called with a dict for every page fetched, decoded,
+		  parsed or extracted, see schoolloop.Metrics
+		- trust_charset: decode pages with the charset in their Content-Type
+		  header without sniffing, see SchoolLoop
+		- markup_massage: markupMassage for the trees built from pages, see
+		  SchoolLoop
+		- compact_soup: build compact trees, see SchoolLoop
+		- timezone_cache: TimezoneCache for the server's UTC offset, by
+		  default the one every SchoolLoop shares, see SchoolLoop
+		- session_store: SessionStore to save the session in after every
+		  login, see SchoolLoop
+		"""
+		self.subdomain = subdomain
+		self.host = host or '%s.schoolloop.com' % subdomain
+		self.eventloop = eventloop
+		self.https = https
+		self.parse_in_executor = parse_in_executor
+		self.timeout = timeout
+		self.metrics = metrics
+		self.trustCharset = trust_charset
+		self.markupMassage = markup_massage
+		self.compactSoup = compact_soup
+		self.pages = page_cache
+		if self.pages is None:
+			self.pages = PageCache()
+		self.loading = {}
+		self.sessionStore = session_store
+		self.user = None
+		self.timezone = None
+		self.timezoneCache = timezone_cache
+		if self.timezoneCache is None:
+			self.timezoneCache = TIMEZONES
+		self.credentials = credentials
+		self.loginGeneration = 0
+		self.relogging = None
+		self.settingCalendar = None
+		self.cookiejar = cookiejar
+		if self.cookiejar is None:
+			self.cookiejar = PickleJar()
+
+	def get_url (self, path):
+		"""
+		Converts an absolute path into a URL.
+
+		- path: path to be converted to a URL
+		"""
+		return '%s://%s%s' % (self.https and 'https' or 'http', self.host, path)
+
+	def open (self, path, data=None, redirect=REDIRECT_FOLLOW, headers={}):
+		"""
+		Coroutine. Requests a path from Schoolloop, see SchoolLoop.open().
+		"""
+		url = self.get_url(path)
+		for i in range(MAX_REDIRECTS):
+			req = urllib2.Request(url, data, headers)
+			self.cookiejar.add_cookie_header(req)
+			response = yield self.eventloop.fetch(req, self.timeout)
+			self.cookiejar.extract_cookies(response, req)
+			location = response.info().get('location')
+			if response.code in (301, 302, 303, 307) and location:
+				newurl = urlparse.urljoin(url, location)
+				if redirect == REDIRECT_LOGIN:
+					raise Return('/portal/login' in newurl and 'fail' or 'success')
+				elif redirect == REDIRECT_STOP:
+					raise Return(newurl)
+				url, data = newurl, None
+				continue
+			if response.code >= 400:
+				raise urllib2.HTTPError(url, response.code, response.msg, response.info(), response)
+			raise Return(response)
+		raise urllib2.HTTPError(url, response.code, 'too many redirects', response.info(), response)
+
+	def login (self, user=None, pswd=None):
+		"""
+		Coroutine. Logs in to Schoolloop and establishes a session, see
+		SchoolLoop.login().
+
+		- user: username, defaults to the stored credentials
+		- pswd: password
+		"""
+		if user is None:
+			user, pswd = self.get_credentials()
+		loginTry = yield self.open('/portal/login?etarget=login_form',
+			urllib.urlencode([('login_name', user), ('password', pswd),
+			('event.login.x', '0'), ('event.login.y', '0')]), REDIRECT_LOGIN)
+		if loginTry != "success":
+			raise Return(False)
+		if not callable(self.credentials):
+			self.credentials = (user, pswd)
+		self.user = user
+		self.loginGeneration += 1
+		if self.sessionStore is not None:
+			self.sessionStore.save(self.subdomain, user, self.cookiejar)
+		raise Return(True)
+
+	def resume (self, user=None):
+		"""
+		Picks up the saved session of user instead of logging in, see
+		SchoolLoop.resume(). Not a coroutine, as it only reads a file.
+		"""
+		if user is None:
+			user = self.get_credentials()[0]
+		if not resume_session(self, user):
+			return False
+		self.user = user
+		self.loginGeneration += 1
+		return True
+
+	def get_credentials (self):
+		if callable(self.credentials):
+			return self.credentials()
+		if not self.credentials:
+			raise LoginError('not logged in and no credentials to log in with')
+		return self.credentials
+
+	def relogin (self, generation=None):
+		"""
+		Coroutine. Logs in again with the stored credentials. Coroutines that
+		find the session expired at once share a single login.
+
+		- generation: value of loginGeneration when the caller's request went out
+		"""
+		if generation is not None and generation != self.loginGeneration:
+			return
+		if self.relogging is None:
+			self.relogging = self.eventloop.spawn(self._relogin())
+		yield self.relogging
+
+	def _relogin (self):
+		try:
+			user, pswd = self.get_credentials()
+			calendarFilter = getattr(self.cookiejar, 'calendarSession', None) is not None
+			if not (yield self.login(user, pswd)):
+				raise LoginError('unable to log in again as %s' % user)
+			if calendarFilter and not (yield self._set_calendar_filter()):
+				# the new session starts with the default filter
+				raise LoginError('logged out again right after logging in')
+		finally:
+			self.relogging = None
+
+	def login_status (self):
+		"""
+		Coroutine. Check if logged in.
+		"""
+		loaded = yield self.page('main', cache=False, relogin=False)
+		raise Return(loaded.raw is not None)
+
+	def page(self, page, params=None, cache=True, relogin=True):
+		"""
+		Coroutine. Fetches a page, caches it, and returns a SchoolLoopPage.
+		Coroutines asking for the same page at the same time share one fetch.
+		If the session has expired, logs in again once and retries.
+
+		- page: page keyword (see PAGE_TABLE)
+		- params: GET params
+		- relogin: set to False to return the logged out page instead
+		"""
+		start = self.metrics is not None and time.time()
+		key = (page, params)
+		if cache:
+			cached = self.pages.get(key)
+			if cached is not None:
+				if start: self.metrics(page_event(page, cached, start, 'hit'))
+				raise Return(cached)
+		if key in self.loading:
+			loaded = yield self.loading[key]
+			if start: self.metrics(page_event(page, loaded, start, 'shared'))
+			raise Return(loaded)
+
+		self.loading[key] = self.eventloop.spawn(self._load(page, params, relogin))
+		try:
+			loaded = yield self.loading[key]
+		finally:
+			del self.loading[key]
+		if loaded.redirect is None:
+			self.pages.put(key, loaded)
+		if start: self.metrics(page_event(page, loaded, start))
+		raise Return(loaded)
+
+	def _load(self, page, params, relogin):
+		generation = self.loginGeneration
+		loaded = SchoolLoopPage(self, PAGE_TABLE[page], params)
+		start = self.metrics is not None and time.time()
+		pageHandle = yield self.open(loaded.url, redirect=REDIRECT_STOP,
+			headers={'Accept-Encoding': ACCEPT_ENCODING})
+		if start: start = loaded.time_request(start, pageHandle)
+		if isinstance(pageHandle, str):
+			loaded.redirect = pageHandle
+			if loaded.logged_out and relogin:
+				yield self.relogin(generation)
+				loaded = yield self._load(page, params, False)
+				if loaded.logged_out:
+					raise LoginError('logged out again right after logging in')
+				loaded.relogged = True
+			raise Return(loaded)
+
+		pageData, loaded.wire_size = read_body(pageHandle)
+		loaded.charset = pageHandle.info().getparam('charset')
+		if start: loaded.timings['download'] = time.time() - start
+		loaded.parse(pageData)
+		raise Return(loaded)
+
+	def region(self, loaded, name):
+		"""
+		Coroutine. Returns SchoolLoopPage.region(name), building it on a
+		worker thread if parse_in_executor is set.
+		"""
+		if self.parse_in_executor:
+			soup = yield self.eventloop.run_in_executor(loaded.region, name)
+		else:
+			soup = loaded.region(name)
+		raise Return(soup)
+
+	def full_soup(self, loaded):
+		"""
+		Coroutine. Returns the soup of the whole page, building it on a
+		worker thread if parse_in_executor is set.
+		"""
+		if self.parse_in_executor:
+			soup = yield self.eventloop.run_in_executor(loaded.getSoup)
+		else:
+			soup = loaded.soup
+		raise Return(soup)
+
+	def class_list(self):
+		"""
+		Coroutine. See SchoolLoop.class_list().
+		"""
+		loaded = yield self.page('main')
+		soup = yield self.region(loaded, 'classes')
+		raise Return(loaded.extract(parse_classes, soup))
+
+	def dropbox_files(self):
+		"""
+		Coroutine. See SchoolLoop.dropbox_files().
+		"""
+		loaded = yield self.page('dropbox')
+		soup = yield self.region(loaded, 'dropbox')
+		raise Return(loaded.extract(parse_dropbox_files, soup))
+
+	def assignment_list(self, class_filter=None):
+		"""
+		Coroutine. See SchoolLoop.assignment_list().
+		"""
+		loaded = yield self.page('main')
+		soup = yield self.full_soup(loaded)
+		raise Return(loaded.extract(parse_assignments, soup))
+
+	def iter_classes(self):
+		"""
+		Coroutine. Fetches the main page and returns the iterator
+		SchoolLoop.iter_classes() does. It parses as it is consumed, on
+		whichever thread consumes it.
+		"""
+		loaded = yield self.page('main')
+		raise Return(loaded.iterate(parse_classes, stream_classes, 'classes'))
+
+	def iter_dropbox_files(self):
+		"""
+		Coroutine. See iter_classes() and SchoolLoop.iter_dropbox_files().
+		"""
+		loaded = yield self.page('dropbox')
+		raise Return(loaded.iterate(parse_dropbox_files, stream_dropbox_files, 'dropbox'))
+
+	def iter_assignments(self):
+		"""
+		Coroutine. See iter_classes() and SchoolLoop.iter_assignments().
+		"""
+		loaded = yield self.page('main')
+		raise Return(loaded.iterate(parse_assignments, stream_assignments))
+
+	def show_all_events(self, force=False):
+		"""
+		Coroutine. Sets the calendar filter to show every kind of event,
+		unless it was already set for this session, see SchoolLoop.
+		Coroutines asking at the same time share one request.
+
+		- force: set it anyway
+		"""
+		session = session_cookie(self.cookiejar)
+		if not force and session is not None and getattr(self.cookiejar, 'calendarSession', None) == session:
+			return
+		if self.settingCalendar is None:
+			self.settingCalendar = self.eventloop.spawn(self._show_all_events())
+		yield self.settingCalendar
+
+	def _show_all_events(self):
+		try:
+			generation = self.loginGeneration
+			if not (yield self._set_calendar_filter()):
+				# the session expired; _relogin() sets the filter for the new one
+				yield self.relogin(generation)
+				if getattr(self.cookiejar, 'calendarSession', None) != session_cookie(self.cookiejar) \
+						and not (yield self._set_calendar_filter()):
+					raise LoginError('logged out again right after logging in')
+		finally:
+			self.settingCalendar = None
+
+	def _set_calendar_filter(self):
+		# returns False if the session had expired
+		redirect = yield self.open('/calendar/setCalendarSettings', CALENDAR_SETTINGS, REDIRECT_STOP)
+		if isinstance(redirect, basestring) and '/portal/login' in redirect:
+			raise Return(False)
+		self.cookiejar.calendarSession = session_cookie(self.cookiejar)
+		if self.sessionStore is not None and self.user is not None:
+			self.sessionStore.save(self.subdomain, self.user, self.cookiejar)
+		raise Return(True)
+
+	def month_params(self, month=None, year=None):
+		"""
+		Coroutine. See SchoolLoop.month_params().
+		"""
+		if self.timezone is None:
+			self.timezone = self.timezoneCache.get(self.subdomain)
+		if self.timezone is None:
+			loaded = yield self.page('calendar')
+			soup = yield self.full_soup(loaded)
+			self.timezone = loaded.extract(parse_timezone, soup)
+			self.timezoneCache.put(self.subdomain, self.timezone)
+		raise Return(calendar_params(self.timezone, month, year))
+
+	def invalidate_timezone(self):
+		"""
+		See SchoolLoop.invalidate_timezone().
+		"""
+		self.timezone = None
+		self.timezoneCache.invalidate(self.subdomain)
+
+	def calendar(self, month=None, year=None):
+		"""
+		Coroutine. See SchoolLoop.calendar().
+		"""
+		yield self.show_all_events()
+
+		params = yield self.month_params(month, year)
+		loaded = yield self.page('calendar', params)
+		soup = yield self.full_soup(loaded)
+		raise Return(loaded.extract(parse_calendar, soup))
+
+	def iter_events(self, month=None, year=None):
+		"""
+		Coroutine. See iter_classes() and SchoolLoop.iter_events().
+		"""
+		yield self.show_all_events()
+
+		params = yield self.month_params(month, year)
+		loaded = yield self.page('calendar', params)
+		raise Return(loaded.iterate(parse_calendar, stream_events))
+
+	def calendar_range(self, start_date, end_date):
+		"""
+		Coroutine. See SchoolLoop.calendar_range(). The months are
+		downloaded at the same time.
+		"""
+		yield self.show_all_events()
+
+		yield self.month_params() # works out the time zone once
+		pages = yield [self.page('calendar', calendar_params(self.timezone, month, year))
+			for month, year in calendar_months(start_date, end_date)]
+		soups = yield [self.full_soup(loaded) for loaded in pages]
+		raise Return(merge_events([loaded.extract(parse_calendar, soup) for loaded, soup in zip(pages, soups)],
+			start_date, end_date))